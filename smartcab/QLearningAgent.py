@@ -1,24 +1,121 @@
-import random
+import os
+import cPickle
+import numpy as np
 from environment import Agent, Environment
 from planner import RoutePlanner
 from simulator import Simulator
+from replay import ReplayBuffer
+from model import TransitionModel
+from seeding import make_rngs
+from qstore import HashedStateIndex, LRUStateIndex
+from metrics import LearningCurve
+
+# Dense integer encoding of (light, oncoming, left, right, waypoint), from Environment.observe() codes
+action_codes = Environment.action_codes
+num_actions = len(Environment.valid_actions)
+num_states = 2 * num_actions ** 4  # light is RED or GREEN
+
+
+def encode_obs(obs):
+    """Map an Environment.observe() code list to a state index in [0, num_states)."""
+    return (((obs[0] * num_actions + obs[1]) * num_actions + obs[2]) * num_actions + obs[3]) * num_actions + obs[4]
+
+
+# Q-table checkpoint file: a .npy array with one record per state
+Q_table_dtype = np.dtype([('Q', np.float64, (num_actions,)), ('visited', np.bool_, (num_actions,))])
+
+
+def checkpoint_path(path):
+    """Q-table checkpoint file name, with the .npy extension np.save would add."""
+    return path if path.endswith('.npy') else path + '.npy'
+
+
+def save_Q_table(path, Q, Q_visited):
+    """Save a Q-table and its visited mask as one binary .npy file."""
+    table = np.empty(len(Q), dtype=Q_table_dtype)
+    table['Q'] = Q
+    table['visited'] = Q_visited
+    np.save(checkpoint_path(path), table)
+
+
+def load_Q_table(path, mmap=False):
+    """Load a Q-table saved by save_Q_table; returns (Q, Q_visited).
+
+    With mmap=True the file is memory-mapped read-only, so many processes share one
+    copy of the table; otherwise the arrays are writable copies.
+    """
+    table = np.load(checkpoint_path(path), mmap_mode='r' if mmap else None)
+    if table.dtype != Q_table_dtype:
+        raise ValueError("{} is not a Q-table checkpoint".format(path))
+    if mmap:
+        return table['Q'], table['visited']
+    return np.array(table['Q']), np.array(table['visited'])
+
+
+def state_rows_path(path):
+    """File next to a Q-table checkpoint that holds the state -> row map of an LRU Q-store."""
+    return checkpoint_path(path)[:-4] + '.rows.pkl'
 
 
 class LearningAgent(Agent):
     """An agent that learns to drive in the smartcab world."""
 
-    def __init__(self, env):
+    __slots__ = ('np_random', 'planner', 'dedline', 'possible_actions', 'state_index', 'Q', 'Q_visited', 'learning', 'alpha', 'gamma', 'epsilon', 'deg_epsilon',
+                 'replay', 'batch_size', 'replay_every', 'num_steps', 'model', 'planning', 'planning_batch', 'planning_every', 'next_state', 'action', 'reward', 'cum_rewards',
+                 'num_moves', 'penalty', 'obs')
+
+    def __init__(self, env, alpha=0.8, gamma=0.4, epsilon=0.1, deg_epsilon=0.01, replay_size=None, batch_size=32, replay_every=4,
+                 planning=None, planning_batch=32, planning_every=20, q_capacity=None, q_eviction='hash', share_with=None):
         super(LearningAgent, self).__init__(env)  # sets self.env = env, state = None, next_waypoint = None, and a default color
         self.color = 'red'  # override color
+        self.random, self.np_random = make_rngs(self.env.spawn_seed())  # own exploration and sampling streams, if the environment is seeded
         self.planner = RoutePlanner(self.env, self)  # simple route planner to get next_waypoint
         self.dedline = self.env.get_deadline(self)
         self.possible_actions = Environment.valid_actions
-        self.Q_dict = dict() # Q(s,a)
 
-        self.alpha = 0.8 # learning rate
-        self.gamma = 0.4 # discount maxQ(s',a')
-        self.epsilon = 0.1 # pick a random action
-        self.deg_epsilon = 0.01 # degradation of ramdom action
+        # Bounded Q-store: with q_capacity, the states returned by state_key() are mapped to q_capacity
+        # rows, by feature hashing (q_eviction='hash', colliding states share a row) or with
+        # least-recently-used eviction ('lru'), so richer states fit in a fixed memory budget
+        assert q_eviction in ('hash', 'lru'), "Invalid q_eviction!"
+        assert not (q_capacity and planning), "Planning needs the dense Q-table (the model grows with q_capacity squared)!"
+        assert not (q_capacity and q_eviction == 'lru' and replay_size), "Replay can't be used with an LRU Q-store (evicted rows would be replayed)!"
+        if q_capacity:
+            self.state_index = HashedStateIndex(q_capacity) if q_eviction == 'hash' else LRUStateIndex(q_capacity, self.forget)
+        else:
+            self.state_index = None
+        n_rows = q_capacity or num_states
+        self.Q = np.full((n_rows, num_actions), 2.0) # Q(s,a), indexed by state rows (see encode) and action_codes
+        self.Q_visited = np.zeros((n_rows, num_actions), dtype=bool) # (s,a) pairs seen by Q_learn
+        self.learning = True # update Q while driving
+
+        self.alpha = alpha # learning rate
+        self.gamma = gamma # discount maxQ(s',a')
+        self.epsilon = epsilon # pick a random action
+        self.deg_epsilon = deg_epsilon # degradation of ramdom action
+
+        # Experience replay: with replay_size, transitions are stored and learned from in
+        # minibatches of batch_size every replay_every steps, instead of one update per step
+        self.replay = ReplayBuffer(replay_size, self.np_random) if replay_size else None
+        self.batch_size = batch_size
+        self.replay_every = replay_every
+        self.num_steps = 0
+
+        # Model-based planning: with planning='dyna', each real step is followed by a minibatch of
+        # planning_batch simulated updates drawn from a learned model; with planning='value_iteration',
+        # a value iteration sweep over the model runs every planning_every real steps
+        assert planning in (None, 'dyna', 'value_iteration'), "Invalid planning!"
+        self.model = TransitionModel(n_rows, num_actions, self.np_random) if planning else None
+        self.planning = planning
+        self.planning_batch = planning_batch
+        self.planning_every = planning_every
+
+        # Learn into the same Q-table (and state index, replay buffer and model) as another LearningAgent
+        if share_with is not None:
+            self.state_index = share_with.state_index
+            self.Q = share_with.Q
+            self.Q_visited = share_with.Q_visited
+            self.replay = share_with.replay
+            self.model = share_with.model
 
         self.state = None
         self.next_state = None
@@ -30,6 +127,7 @@ class LearningAgent(Agent):
         self.penalty = 0
 
         self.next_waypoint = None
+        self.obs = [0] * 5  # Environment.observe() buffer
 
     def reset(self, destination=None):
         self.planner.route_to(destination)
@@ -44,52 +142,112 @@ class LearningAgent(Agent):
 
         self.next_waypoint = None
 
+    def save(self, path):
+        # Checkpoint the Q-table, and the state -> row map of an LRU Q-store next to it
+        save_Q_table(path, self.Q, self.Q_visited)
+        if isinstance(self.state_index, LRUStateIndex):
+            with open(state_rows_path(path), 'wb') as f:
+                cPickle.dump(self.state_index.items(), f, cPickle.HIGHEST_PROTOCOL)
+
+    def load(self, path, mmap=False):
+        # Warm-start from a checkpoint; a memory-mapped table is read-only, so learning is turned off
+        lru = isinstance(self.state_index, LRUStateIndex)
+        if lru != os.path.exists(state_rows_path(path)):
+            raise ValueError("{} was not saved by an agent with {} Q-store".format(path, "an LRU" if lru else "a dense or hashed"))
+        Q, Q_visited = load_Q_table(path, mmap=mmap)
+        if mmap:
+            self.Q, self.Q_visited = Q, Q_visited
+            self.learning = False
+        else:
+            # copy in place, so agents sharing this table see it too
+            self.Q[...] = Q
+            self.Q_visited[...] = Q_visited
+        if lru:
+            with open(state_rows_path(path), 'rb') as f:
+                self.state_index.restore(cPickle.load(f))
+
+    def state_key(self, obs):
+        # State learned over, from an Environment.observe() code list; override to add features
+        # such as the deadline or location (they need a bounded Q-store, see q_capacity)
+        return encode_obs(obs)
+
+    def encode(self, obs):
+        # Q-table row of an observation; None for a state an LRU Q-store has no row for while not learning
+        key = self.state_key(obs)
+        return key if self.state_index is None else self.state_index.index(key, evict=self.learning)
+
+    def forget(self, row):
+        # A bounded Q-store reuses a row for another state: start it afresh
+        self.Q[row] = 2.0
+        self.Q_visited[row] = False
+
     def qval(self, state, action):
         # Q value (s,a)
-        key = (state, action)
-        return self.Q_dict.get(key, 2.0)
+        return self.Q[state, action_codes[action]]
 
     def maxQ(self, state):
         # Returns maxQ(s,a)
-        q = [self.qval(state, a) for a in self.possible_actions]
-        return max(q)
+        return self.Q[state].max()
 
     def epsilon_greedy(self, state):
         # Choose the best action with Epsilon-Greedy approach
-        if random.random() < self.epsilon:
+        if state is None:
+            return self.random.choice(self.possible_actions)  # unknown state (see encode)
+        if self.random.random() < self.epsilon:
             self.epsilon -= self.deg_epsilon
-            max_action = random.choice(self.possible_actions)
+            max_action = self.random.choice(self.possible_actions)
 
         else:
-            max_action = self.possible_actions[0]
-            max_reward = None
-            # Find maximum
-            for action in self.possible_actions:
-                cur_reward = self.qval(state, action)
-                if cur_reward > max_reward:
-                    max_reward = cur_reward
-                    max_action = action # max_action is argmax
-                elif cur_reward == max_reward:
-                    max_action = random.choice([max_action, action])
+            # argmax, breaking ties at random
+            q = self.Q[state]
+            max_action = self.possible_actions[self.random.choice(np.flatnonzero(q == q.max()))]
         return max_action
 
     def Q_learn(self, state, action, nextState, reward):
-        key = (state, action)
-        if (key not in self.Q_dict):
-			# initialize the q values
-			self.Q_dict[key] = 2.0
+        a = action_codes[action]
+        if not self.Q_visited[state, a]:
+            # initialize the q values
+            self.Q_visited[state, a] = True
         else:
-            self.Q_dict[key] = self.Q_dict[key] + self.alpha * (reward + self.gamma * self.maxQ(nextState) - self.Q_dict[key])
+            self.Q[state, a] += self.alpha * (reward + self.gamma * self.maxQ(nextState) - self.Q[state, a])
+
+    def Q_learn_batch(self, states, actions, nextStates, rewards):
+        # Vectorized Q_learn over a minibatch of visited (s,a) pairs (actions as codes);
+        # pairs sampled more than once get a single update with their mean TD error
+        errors = rewards + self.gamma * self.Q[nextStates].max(axis=1) - self.Q[states, actions]
+        sampled, pair = np.unique(states * num_actions + actions, return_inverse=True)  # O(batch), whatever the table size
+        total = np.bincount(pair, weights=errors)
+        count = np.bincount(pair)
+        self.Q[sampled // num_actions, sampled % num_actions] += self.alpha * total / count
+
+    def remember(self, state, action, nextState, reward):
+        # Store a transition, and replay a minibatch every replay_every steps
+        a = action_codes[action]
+        if not self.Q_visited[state, a]:
+            # initialize the q values
+            self.Q_visited[state, a] = True
+        self.replay.add(state, a, reward, nextState)
+        self.num_steps += 1
+        if self.num_steps % self.replay_every == 0:
+            states, actions, rewards, next_states = self.replay.sample(self.batch_size)
+            self.Q_learn_batch(states, actions, next_states, rewards)
+
+    def plan(self, state, action, nextState, reward):
+        # Add a real step to the model, then learn from the model
+        self.model.add(state, action_codes[action], reward, nextState)
+        if self.planning == 'dyna':
+            states, actions, rewards, next_states = self.model.sample(self.planning_batch)
+            self.Q_learn_batch(states, actions, next_states, rewards)
+        elif len(self.model) % self.planning_every == 0:
+            self.model.value_iteration(self.Q, self.gamma)
 
     def update(self, t):
         # Gather inputs
-        self.next_waypoint = self.planner.next_waypoint()  # from route planner, also displayed by simulator
-        inputs = self.env.sense(self)
+        obs = self.env.observe(self, self.obs)  # also sets next_waypoint from route planner, displayed by simulator
         deadline = self.env.get_deadline(self)
 
         # Update state
-        self.next_state = (tuple(inputs.values()), self.next_waypoint)
-        #self.next_state = (inputs["light"], self.next_waypoint)
+        self.next_state = self.encode(obs)
 
         # Update action
         next_action = self.epsilon_greedy(self.next_state)
@@ -98,9 +256,14 @@ class LearningAgent(Agent):
         next_reward = self.env.act(self, next_action)
 
         # Learn policy based on state, action, reward
-        if self.reward != None:
+        if self.learning and self.state is not None:
             # update Q-value
-            self.Q_learn(self.state, self.action, self.next_state, self.reward)
+            if self.replay is not None:
+                self.remember(self.state, self.action, self.next_state, self.reward)
+            else:
+                self.Q_learn(self.state, self.action, self.next_state, self.reward)
+            if self.model is not None:
+                self.plan(self.state, self.action, self.next_state, self.reward)
 
         # Update stats
         self.state = self.next_state
@@ -109,27 +272,46 @@ class LearningAgent(Agent):
         self.cum_rewards += next_reward
         self.num_moves += 1
 
-        #print "LearningAgent.update(): deadline = {}, inputs = {}, action = {}, reward = {}".format(deadline, inputs, next_action, next_reward)  # [debug]
+        #print "LearningAgent.update(): deadline = {}, obs = {}, action = {}, reward = {}".format(deadline, obs, next_action, next_reward)  # [debug]
+
+def run(load=None, save=None, n_learners=1, curve=None, target=None):
+    """Run the agent for a finite number of trials.
 
-def run():
-    """Run the agent for a finite number of trials."""
+    Optionally warm-start from the Q-table checkpoint load, and save the learned one to save.
+    With n_learners > 1, more cabs learn into the same Q-table, each with its own trip.
+    The learning curve is saved to curve if given (see LearningCurve.save); with a target
+    rolling success rate, training stops early once it is reached.
+    """
 
     # Set up environment and agent
     e = Environment()  # create environment (also adds some dummy traffic)
     a = e.create_agent(LearningAgent)  # create agent
+    if load is not None:
+        a.load(load)
+    for i in xrange(n_learners - 1):
+        e.track_agent(e.create_agent(LearningAgent, share_with=a))
     e.set_primary_agent(a, enforce_deadline=True)  # specify agent to track
     # You can set enforce_deadline=False while debugging to allow longer trials
+    e.metrics = LearningCurve(window=20, every=5, target=target)  # per-trial learning curve
 
     # Now simulate it
-    sim = Simulator(e, update_delay=.0001, display=False)  # create simulator (uses pygame when display=True, if available)
-    # To speed up simulation, reduce update_delay and/or set display=False
+    sim = Simulator(e, update_delay=0.0, display=False)  # create simulator (uses pygame when display=True, if available)
+    # With display=False and update_delay=0, the simulator steps as fast as possible (headless mode)
 
     sim.run(n_trials=100)  # run for a specified number of trials
     # To quit midway, press Esc or close pygame window, or hit Ctrl+C on the command-line
 
+    if save is not None:
+        a.save(save)
+
     # Status reports
     print "Win: {} / ".format(e.win) + "Lose: {} ".format(e.lose) # Success rates
     print "Penalty: {} / ".format(e.penalty) + "Reward: {} / ".format(a.cum_rewards) + "Move: {} ".format(a.num_moves) # Other evaluation
+    success_rate, penalties, reward, steps_to_goal, slack = e.metrics.rolling()
+    print "Last {} trials of {}: success rate: {:.2f} / penalties: {:.2f} / reward: {:.2f} / steps to goal: {:.2f} / slack: {:.2f}".format(
+        min(e.metrics.n_trials, e.metrics.window), e.metrics.n_trials, success_rate, penalties, reward, steps_to_goal, slack)
+    if curve is not None:
+        e.metrics.save(curve)
 
 if __name__ == '__main__':
     run()
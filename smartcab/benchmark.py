@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import argparse
+from environment import Environment
+from simulator import Simulator
+from profiler import timer
+from QLearningAgent import LearningAgent
+
+# (grid_size, num_dummies) pairs benchmarked by default
+configs = [((8, 6), 3), ((8, 6), 30), ((16, 12), 100)]
+
+# Metrics where larger is better; all others are latencies (seconds per call), where smaller is better
+throughputs = ['steps_per_sec', 'trials_per_sec']
+
+
+def config_name(grid_size, num_dummies):
+    return "grid{}x{}_dummies{}".format(grid_size[0], grid_size[1], num_dummies)
+
+
+def latency(func, n_calls):
+    """Mean seconds per call of func() over n_calls calls."""
+    start = timer()
+    for i in xrange(n_calls):
+        func()
+    return (timer() - start) / n_calls
+
+
+def bench(grid_size=(8, 6), num_dummies=3, n_trials=100, n_calls=2000, seed=0):
+    """Benchmark one world size with fixed seeds.
+
+    Returns a dict of steps_per_sec and trials_per_sec over n_trials headless trials with a
+    learning primary agent, and mean latencies (seconds) of single Environment.step, sense,
+    act, RoutePlanner.next_waypoint, LearningAgent.update and Simulator.render calls.
+    render is None if pygame is not available.
+    """
+    e = Environment(num_dummies=num_dummies, grid_size=grid_size, verbose=False, seed=seed)
+    a = e.create_agent(LearningAgent)
+    e.set_primary_agent(a, enforce_deadline=True)
+    sim = Simulator(e, update_delay=0.0, display=False)
+
+    start = timer()
+    n_steps = sim.run(n_trials=n_trials)
+    elapsed = timer() - start
+    results = {'steps_per_sec': n_steps / elapsed, 'trials_per_sec': n_trials / elapsed}
+
+    def step():
+        if e.done:
+            e.reset()
+        e.step()
+
+    e.reset()
+    results['step'] = latency(step, n_calls)
+    e.reset()
+    results['sense'] = latency(lambda: e.sense(a), n_calls)
+    results['act'] = latency(lambda: e.act(a, None), n_calls)  # null move, so the world stays put
+    results['next_waypoint'] = latency(a.planner.next_waypoint, n_calls)
+    results['update'] = latency(lambda: a.update(e.t), n_calls)
+
+    # Render offscreen (recording sets up pygame without a window; no frames are saved here)
+    render_sim = Simulator(e, update_delay=0.0, display=False, record=os.devnull, verbose=False)
+    if render_sim.record is not None:
+        render_sim.render()  # first frame draws the cached background
+        results['render'] = latency(render_sim.render, max(1, n_calls // 10))
+    else:
+        results['render'] = None
+    return results
+
+
+def best(runs):
+    """Merge results of repeated bench() runs, keeping the best value of each metric (least affected by noise)."""
+    merged = {}
+    for metric in runs[0]:
+        values = [r[metric] for r in runs if r[metric] is not None]
+        merged[metric] = (max(values) if metric in throughputs else min(values)) if values else None
+    return merged
+
+
+def run_suite(configs=configs, n_trials=100, n_calls=2000, repeat=3, seed=0):
+    """Benchmark every (grid_size, num_dummies) config, best of repeat runs; returns {config name: results}."""
+    return dict((config_name(grid_size, num_dummies), best([bench(grid_size, num_dummies, n_trials=n_trials, n_calls=n_calls, seed=seed)
+                                                            for i in xrange(repeat)]))
+                for grid_size, num_dummies in configs)
+
+
+def compare(results, baseline, threshold=0.2):
+    """Regressions of results against baseline, as (config, metric, baseline value, value) tuples.
+
+    A throughput regresses when it drops by more than threshold (a fraction of the baseline),
+    a latency when it grows by more than threshold. Metrics missing on either side are skipped.
+    """
+    regressions = []
+    for name in sorted(results):
+        for metric, value in sorted(results[name].iteritems()):
+            base = baseline.get(name, {}).get(metric)
+            if value is None or base is None:
+                continue
+            if metric in throughputs:
+                regressed = value < base * (1 - threshold)
+            else:
+                regressed = value > base * (1 + threshold)
+            if regressed:
+                regressions.append((name, metric, base, value))
+    return regressions
+
+
+def format_table(results):
+    """Format results as a text table, one row per config (latencies in microseconds)."""
+    metrics = throughputs + ['step', 'sense', 'act', 'next_waypoint', 'update', 'render']
+    lines = ['{:<24}'.format('config') + ' '.join('{:>14}'.format(m) for m in metrics)]
+    for name in sorted(results):
+        row = results[name]
+        cells = []
+        for m in metrics:
+            if row.get(m) is None:
+                cells.append('{:>14}'.format('-'))
+            else:
+                cells.append('{:>14.1f}'.format(row[m] if m in throughputs else 1e6 * row[m]))
+        lines.append('{:<24}'.format(name) + ' '.join(cells))
+    return '\n'.join(lines)
+
+
+def run(save=None, baseline=None, threshold=0.2, n_trials=100, n_calls=2000, repeat=3):
+    """Run the suite, optionally saving results as JSON and checking them against a saved baseline.
+
+    Returns False if any metric regressed past threshold.
+    """
+    results = run_suite(n_trials=n_trials, n_calls=n_calls, repeat=repeat)
+    print format_table(results)
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), threshold)
+        for name, metric, base, value in regressions:
+            print "Regression: {} {}: {:.6g} -> {:.6g}".format(name, metric, base, value)
+        return not regressions
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the smartcab simulation and learning hot paths.")
+    parser.add_argument('--save', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file from an earlier --save to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed relative slowdown (default: 0.2)")
+    parser.add_argument('--trials', type=int, default=100, help="trials per config (default: 100)")
+    parser.add_argument('--calls', type=int, default=2000, help="calls per latency measurement (default: 2000)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per config, keeping the best of each metric (default: 3)")
+    args = parser.parse_args()
+    if not run(save=args.save, baseline=args.baseline, threshold=args.threshold, n_trials=args.trials, n_calls=args.calls, repeat=args.repeat):
+        sys.exit(1)
@@ -1,26 +1,46 @@
 import time
 import random
+from array import array
+from bisect import insort
 from collections import OrderedDict
 
+import numpy as np
+
+import telemetry
+from profiler import timer
+from seeding import child_seed, make_rngs
 from simulator import Simulator
 
+# Integer codes of the low-level observation API (see Environment.sense_codes)
+RED, GREEN = 0, 1
+NONE, FORWARD, LEFT, RIGHT = 0, 1, 2, 3  # indices into Environment.valid_actions
+
+
 class TrafficLight(object):
-    """A traffic light that switches periodically."""
+    """A traffic light that switches periodically.
+
+    The state is a closed-form function of the time since the last reset, so it
+    is only computed when read instead of being advanced every tick. The time is
+    read from the owning environment's light_time.
+    """
 
     valid_states = [True, False]  # True = NS open, False = EW open
 
-    def __init__(self, state=None, period=None):
-        self.state = state if state is not None else random.choice(self.valid_states)
-        self.period = period if period is not None else random.choice([3, 4, 5])
-        self.last_updated = 0
+    def __init__(self, state=None, period=None, rng=random, env=None):
+        self.initial_state = state if state is not None else rng.choice(self.valid_states)  # state at t = 0
+        self.period = period if period is not None else rng.choice([3, 4, 5])
+        self.env = env
 
-    def reset(self):
-        self.last_updated = 0
+    def reset(self, t):
+        # Carry the state reached at t over to the new trial
+        self.initial_state = self.state_at(t)
 
-    def update(self, t):
-        if t - self.last_updated >= self.period:
-            self.state = not self.state  # assuming state is boolean
-            self.last_updated = t
+    def state_at(self, t):
+        return self.initial_state != ((t // self.period) % 2 == 1)  # switches every period steps
+
+    @property
+    def state(self):
+        return self.state_at(self.env.light_time if self.env is not None else 0)
 
 
 class Environment(object):
@@ -29,10 +49,25 @@ class Environment(object):
     valid_actions = [None, 'forward', 'left', 'right']
     valid_inputs = {'light': TrafficLight.valid_states, 'oncoming': valid_actions, 'left': valid_actions, 'right': valid_actions}
     valid_headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]  # ENWS
+    heading_index = dict((heading, i) for i, heading in enumerate(valid_headings))
+    action_codes = dict((action, i) for i, action in enumerate(valid_actions))  # NONE, FORWARD, LEFT, RIGHT
     hard_time_limit = -100  # even if enforce_deadline is False, end trial when deadline reaches this value (to avoid deadlocks)
 
-    def __init__(self, num_dummies=3):
+    def __init__(self, num_dummies=3, grid_size=(8, 6), verbose=False, batched_dummies=False, seed=None):
+        # Random streams owned by this environment (and its dummy agents); agents can ask for their own
+        # with spawn_seed(). Without a seed, the global random and np.random modules are used.
+        self.seed = seed
+        self.random, self.np_random = make_rngs(seed)
+        self.num_spawned = 0  # no. of child seeds handed out
+
         self.num_dummies = num_dummies  # no. of dummy agents
+        self.batched_dummies = batched_dummies  # keep dummies in arrays and move them all at once (see update_dummies)
+        self.verbose = verbose  # print trial outcomes
+        self.show_status = verbose  # keep status_text up to date (shown by the simulator)
+        self.telemetry = None  # optional Telemetry sink for primary agent steps and trials
+        self.metrics = None  # optional LearningCurve, fed one record per trial of the primary agent
+        self.trace = None  # optional TraceRecorder of every tick
+        self.profiler = None  # optional PhaseProfiler, see enable_profiling()
 
         # status report trackers
         self.win = 0
@@ -42,155 +77,461 @@ class Environment(object):
         # Initialize simulation variables
         self.done = False
         self.t = 0
-        self.agent_states = OrderedDict()
+        self.trial = -1  # no. of the current trial (counting from 0)
+        self.agents = []  # agents by id (creation order)
+        self.occupancy = {}  # intersection index -> sorted ids of agents there
+        # Agent states, in parallel typed arrays indexed by agent id (see agent_state() for a dict view);
+        # unlike NumPy arrays, they yield plain ints to the per-agent code and grow in amortized time
+        self.agent_locations = array('i')  # intersection indices
+        self.agent_headings = array('b')  # valid_headings indices
+        self.agent_destinations = array('i')  # intersection indices, -1 = no destination
+        self.agent_deadlines = array('i')
+        self.agent_done = array('b')
         self.status_text = ""
+        self.act_inputs = [0, 0, 0, 0]  # sense_codes() buffer for act()
 
         # Road network
-        self.grid_size = (8, 6)  # (cols, rows)
+        self.grid_size = grid_size  # (cols, rows)
         self.bounds = (1, 1, self.grid_size[0], self.grid_size[1])
         self.block_size = 100
         self.intersections = OrderedDict()
         self.roads = []
         for x in xrange(self.bounds[0], self.bounds[2] + 1):
             for y in xrange(self.bounds[1], self.bounds[3] + 1):
-                self.intersections[(x, y)] = TrafficLight()  # a traffic light at each intersection
-
-        for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
+                self.intersections[(x, y)] = TrafficLight(rng=self.random, env=self)  # a traffic light at each intersection
+        self.intersection_list = self.intersections.keys()  # for random choices, in intersections order
+        self.intersection_index = dict((location, i) for i, location in enumerate(self.intersection_list))
+        self.light_time = 0  # time of the last light update; light states are computed from it on demand
+        self.sync_lights()
+
+        # Roads join intersections at L1 distance 1 (in both directions, ordered as in intersections)
+        for a in self.intersection_list:
+            for b in ((a[0] - 1, a[1]), (a[0], a[1] - 1), (a[0], a[1] + 1), (a[0] + 1, a[1])):
+                if b in self.intersection_index:
                     self.roads.append((a, b))
 
+        # Adjacency: neighbors[i, h] is the index of the intersection reached from intersection i
+        # by moving along valid_headings[h], with wrap-around
+        cols, rows = self.grid_size
+        index = np.arange(cols * rows).reshape(cols, rows)  # index[x - 1, y - 1], matching intersections order
+        self.neighbors = np.empty((cols * rows, len(self.valid_headings)), dtype=np.int64)
+        for h, heading in enumerate(self.valid_headings):
+            self.neighbors[:, h] = np.roll(index, (-heading[0], -heading[1]), axis=(0, 1)).ravel()
+
         # Dummy agents
-        for i in xrange(self.num_dummies):
-            self.create_agent(DummyAgent)
+        if self.batched_dummies:
+            n = self.num_dummies
+            self.dummy_locations = self.np_random.randint(0, len(self.intersection_list), size=n)  # intersection indices
+            self.dummy_headings = np.full(n, self.valid_headings.index((0, 1)), dtype=np.int64)  # valid_headings indices
+            self.dummy_waypoints = self.np_random.randint(1, len(self.valid_actions), size=n)  # valid_actions indices
+            self.dummy_colors = [self.random.choice(DummyAgent.color_choices) for i in xrange(n)]
+            self.index_dummies()
+        else:
+            for i in xrange(self.num_dummies):
+                self.create_agent(DummyAgent)
 
         # Primary agent and associated parameters
         self.primary_agent = None  # to be set explicitly
+        self.tracked_agents = []  # primary agent first, then any others added with track_agent()
         self.enforce_deadline = False
 
     def create_agent(self, agent_class, *args, **kwargs):
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location': random.choice(self.intersections.keys()), 'heading': (0, 1)}
+        agent.id = len(self.agents)
+        self.agents.append(agent)
+        self.agent_locations.append(self.intersection_index[self.random.choice(self.intersection_list)])
+        self.agent_headings.append(self.heading_index[(0, 1)])
+        self.agent_destinations.append(-1)
+        self.agent_deadlines.append(0)
+        self.agent_done.append(False)
+        self.occupy(agent, self.agent_locations[agent.id])
         return agent
 
+    def spawn_seed(self):
+        """Seed for a new child stream (e.g. an agent's own RNG), or None if this environment is unseeded."""
+        if self.seed is None:
+            return None
+        self.num_spawned += 1
+        return child_seed(self.seed, self.num_spawned)
+
+    def agent_state(self, agent):
+        """State of an agent as a dict: location, heading, destination (None if it has none), deadline and done."""
+        i = agent.id
+        destination = self.agent_destinations[i]
+        return {'location': self.intersection_list[self.agent_locations[i]],
+                'heading': self.valid_headings[self.agent_headings[i]],
+                'destination': self.intersection_list[destination] if destination >= 0 else None,
+                'deadline': self.agent_deadlines[i] if destination >= 0 else None,
+                'done': bool(self.agent_done[i])}
+
+    def occupy(self, agent, location):
+        # location is an intersection index
+        insort(self.occupancy.setdefault(location, []), agent.id)
+
+    def vacate(self, agent, location):
+        ids = self.occupancy[location]
+        ids.remove(agent.id)
+        if not ids:
+            del self.occupancy[location]
+
+    def retire(self, agent):
+        """Mark a tracked agent done and take it off the road until reset(), so other cars no longer sense it."""
+        if not self.agent_done[agent.id]:
+            self.agent_done[agent.id] = True
+            self.vacate(agent, self.agent_locations[agent.id])
+
     def set_primary_agent(self, agent, enforce_deadline=False):
         self.primary_agent = agent
         self.enforce_deadline = enforce_deadline
+        if agent not in self.tracked_agents:
+            self.tracked_agents.insert(0, agent)
+
+    def track_agent(self, agent):
+        """Track another agent like the primary one: it gets its own destination and deadline,
+        and counts towards win/lose. A trial ends when all tracked agents are done."""
+        if agent not in self.tracked_agents:
+            self.tracked_agents.append(agent)
 
     def reset(self):
+        self.end_trial()
         self.done = False
         self.t = 0
+        self.trial += 1
 
         # Reset traffic lights
         for traffic_light in self.intersections.itervalues():
-            traffic_light.reset()
-
-        # Pick a start and a destination
-        start = random.choice(self.intersections.keys())
-        destination = random.choice(self.intersections.keys())
-
-        # Ensure starting location and destination are not too close
-        while self.compute_dist(start, destination) < 4:
-            start = random.choice(self.intersections.keys())
-            destination = random.choice(self.intersections.keys())
-
-        start_heading = random.choice(self.valid_headings)
-        deadline = self.compute_dist(start, destination) * 5
-        #print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
+            traffic_light.reset(self.light_time)
+        self.light_time = 0
+        self.sync_lights()
+
+        # Pick a start and a destination for each tracked agent
+        trips = {}
+        for agent in self.tracked_agents:
+            start = self.random.choice(self.intersection_list)
+            destination = self.random.choice(self.intersection_list)
+
+            # Ensure starting location and destination are not too close
+            while self.compute_dist(start, destination) < 4:
+                start = self.random.choice(self.intersection_list)
+                destination = self.random.choice(self.intersection_list)
+
+            start_heading = self.random.choice(self.valid_headings)
+            deadline = self.compute_dist(start, destination) * 5
+            trips[agent] = (start, start_heading, destination, deadline)
+            #print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
 
         # Initialize agent(s)
-        for agent in self.agent_states.iterkeys():
-            self.agent_states[agent] = {
-                'location': start if agent is self.primary_agent else random.choice(self.intersections.keys()),
-                'heading': start_heading if agent is self.primary_agent else random.choice(self.valid_headings),
-                'destination': destination if agent is self.primary_agent else None,
-                'deadline': deadline if agent is self.primary_agent else None}
-            agent.reset(destination=(destination if agent is self.primary_agent else None))
+        if self.batched_dummies:
+            self.dummy_locations = self.np_random.randint(0, len(self.intersection_list), size=self.num_dummies)
+            self.dummy_headings = self.np_random.randint(0, len(self.valid_headings), size=self.num_dummies)
+            self.index_dummies()
+        self.occupancy = {}
+        for i, agent in enumerate(self.agents):
+            trip = trips.get(agent)
+            if trip is not None:
+                start, start_heading, destination, deadline = trip
+                self.agent_destinations[i] = self.intersection_index[destination]
+                self.agent_deadlines[i] = deadline
+            else:
+                start = self.random.choice(self.intersection_list)
+                start_heading = self.random.choice(self.valid_headings)
+                self.agent_destinations[i] = -1
+                self.agent_deadlines[i] = 0
+            self.agent_done[i] = False
+            self.agent_locations[i] = self.intersection_index[start]
+            self.agent_headings[i] = self.heading_index[start_heading]
+            self.occupy(agent, self.agent_locations[i])
+            agent.reset(destination=(trip[2] if trip is not None else None))
+
+        if self.trace is not None:
+            self.trace.begin_trial(self)
+
+    def sync_lights(self):
+        """Copy the traffic lights' initial states and periods into light_initial and light_periods.
+
+        The TrafficLight objects are the source of truth; these arrays are their vectorized copies
+        for update_dummies(), light_states() and traces, rebuilt on every reset().
+        """
+        self.light_initial = np.array([tl.initial_state for tl in self.intersections.itervalues()])
+        self.light_periods = np.array([tl.period for tl in self.intersections.itervalues()])
+
+    def end_trial(self):
+        """Record the current trial in trace and metrics, if not recorded yet."""
+        if self.trace is not None:
+            self.trace.end_trial()
+        if self.metrics is None or self.trial < 0 or self.metrics.last_trial == self.trial or self.primary_agent is None:
+            return
+        i = self.primary_agent.id
+        success = self.agent_destinations[i] >= 0 and self.agent_locations[i] == self.agent_destinations[i]
+        self.metrics.record_trial(self.trial, success, self.agent_deadlines[i])
+
+    def enable_profiling(self, profiler):
+        """Time the phases of each step (lights, dummies, primary, sense, act, step) in profiler."""
+        self.disable_profiling()
+        self.profiler = profiler
+        self.sense_codes = profiler.wrap('sense', self.sense_codes)
+        self.act = profiler.wrap('act', self.act)
+
+    def disable_profiling(self):
+        self.profiler = None
+        self.__dict__.pop('sense_codes', None)
+        self.__dict__.pop('act', None)
 
     def step(self):
         #print "Environment.step(): t = {}".format(self.t)  # [debug]
+        if self.profiler is not None:
+            return self.profiled_step()
 
-        # Update traffic lights
-        for intersection, traffic_light in self.intersections.iteritems():
-            traffic_light.update(self.t)
+        # Update traffic lights (their states are only computed when sensed)
+        self.light_time = self.t
 
         # Update agents
-        for agent in self.agent_states.iterkeys():
-            agent.update(self.t)
-
+        if self.batched_dummies:
+            self.update_dummies()
+        done = self.agent_done
+        for i, agent in enumerate(self.agents):
+            if not done[i]:
+                agent.update(self.t)
+
+        self.finish_step()
+
+    def profiled_step(self):
+        """Same as step(), accumulating the time spent in each phase in self.profiler."""
+        profiler = self.profiler
+        start = timer()
+
+        self.light_time = self.t
+        profiler.add('lights', timer() - start)
+
+        if self.batched_dummies:
+            agent_start = timer()
+            self.update_dummies()
+            profiler.add('dummies', timer() - agent_start)
+        done = self.agent_done
+        for i, agent in enumerate(self.agents):
+            if not done[i]:
+                agent_start = timer()
+                agent.update(self.t)
+                profiler.add('primary' if self.agent_destinations[i] >= 0 else 'dummies', timer() - agent_start)
+
+        self.finish_step()
+        profiler.add('step', timer() - start)
+
+    def finish_step(self):
+        if self.trace is not None:
+            self.trace.record_tick(self)
         if self.done:
             return  # primary agent might have reached destination
 
-        if self.primary_agent is not None:
-            agent_deadline = self.agent_states[self.primary_agent]['deadline']
+        for agent in self.tracked_agents:
+            i = agent.id
+            if self.agent_done[i]:
+                continue
+            agent_deadline = self.agent_deadlines[i]
             if agent_deadline <= self.hard_time_limit:
-                self.done = True
-                print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
+                self.retire(agent)
+                if self.telemetry is not None and agent is self.primary_agent:
+                    self.telemetry.record_trial(self.trial, self.t + 1, telemetry.ABORT, agent_deadline)
+                if self.verbose:
+                    print "Environment.step(): {} hit hard time limit ({})! Trial aborted.".format(self.agent_name(agent), self.hard_time_limit)
             elif self.enforce_deadline and agent_deadline <= 0:
-                self.done = True
+                self.retire(agent)
                 self.lose += 1
-                print "Environment.step(): Primary agent ran out of time! Trial aborted."
-            self.agent_states[self.primary_agent]['deadline'] = agent_deadline - 1
+                if self.telemetry is not None and agent is self.primary_agent:
+                    self.telemetry.record_trial(self.trial, self.t + 1, telemetry.LOSE, agent_deadline)
+                if self.verbose:
+                    print "Environment.step(): {} ran out of time! Trial aborted.".format(self.agent_name(agent))
+            self.agent_deadlines[i] = agent_deadline - 1
+        self.done = self.all_done()
 
         self.t += 1
 
+    def update_dummies(self):
+        """Move all batched dummies in one array pass.
+
+        Dummies follow DummyAgent.update: take their waypoint if it is legal given the light
+        and cross traffic, then pick a new random waypoint. Unlike DummyAgent objects, they all
+        sense the same snapshot taken before any of them moves, and move together.
+        """
+        n = self.num_dummies
+        if n == 0:
+            return
+        locations = self.dummy_locations
+        headings = self.dummy_headings
+        waypoints = self.dummy_waypoints
+
+        # All cars at the start of the tick, in sense() order: dummies, then other agents by id (except retired ones)
+        on_road = np.flatnonzero(np.frombuffer(self.agent_done, dtype=np.int8) == 0)
+        car_locations = np.concatenate((locations, np.frombuffer(self.agent_locations, dtype=np.int32)[on_road])).astype(np.int64)
+        car_headings = np.concatenate((headings, np.frombuffer(self.agent_headings, dtype=np.int8)[on_road])).astype(np.int64)
+        car_waypoints = np.concatenate((waypoints, [self.action_codes[self.agents[i].get_next_waypoint()] for i in on_road])).astype(np.int64)
+
+        # Summarize each (intersection, heading) group the way sense() combines cars coming from one side:
+        # oncoming 'left' and left 'forward' take precedence, otherwise the last car in order wins
+        groups, car_group = np.unique(car_locations * 4 + car_headings, return_inverse=True)
+        any_forward = np.zeros(len(groups), dtype=bool)
+        any_forward[car_group[car_waypoints == 1]] = True
+        any_left = np.zeros(len(groups), dtype=bool)
+        any_left[car_group[car_waypoints == 2]] = True
+        last_car = np.full(len(groups), -1, dtype=np.int64)
+        np.maximum.at(last_car, car_group, np.arange(len(car_group)))
+        last_waypoint = car_waypoints[last_car]
+
+        def lookup(relative_heading):
+            keys = locations * 4 + (headings + relative_heading) % 4
+            i = np.minimum(np.searchsorted(groups, keys), len(groups) - 1)
+            return i, groups[i] == keys
+
+        left_i, left_present = lookup(3)  # cars coming from the left
+        oncoming_i, oncoming_present = lookup(2)
+        left_forward = left_present & any_forward[left_i]
+        oncoming_crossing = oncoming_present & ~any_left[oncoming_i] & ((last_waypoint[oncoming_i] == 1) | (last_waypoint[oncoming_i] == 3))
+
+        ns_open = self.light_initial[locations] != ((self.light_time // self.light_periods[locations]) % 2 == 1)
+        red = (headings % 2 == 1) != ns_open  # headings 1 and 3 are NS
+
+        # Same rules as DummyAgent.update
+        okay = ~((waypoints == 3) & red & left_forward)
+        okay &= ~((waypoints == 1) & red)
+        okay &= ~((waypoints == 2) & (red | oncoming_crossing))
+
+        # Move with wrap-around, turning left (+1) or right (-1) as needed, and pick new waypoints
+        turn = np.where(waypoints == 2, 1, np.where(waypoints == 3, -1, 0))
+        headings[okay] = (headings[okay] + turn[okay]) % 4
+        locations[okay] = self.neighbors[locations[okay], headings[okay]]
+        waypoints[okay] = self.np_random.randint(1, len(self.valid_actions), size=okay.sum())
+        self.index_dummies()
+
+    def index_dummies(self):
+        """Bucket batched dummies by intersection, the batched counterpart of occupancy: the dummies at
+        intersection i are dummy_order[dummy_starts[i]:dummy_starts[i + 1]], in creation order."""
+        self.dummy_order = np.argsort(self.dummy_locations, kind='mergesort')  # stable
+        self.dummy_starts = np.searchsorted(self.dummy_locations[self.dummy_order], np.arange(len(self.intersection_list) + 1))
+
+    def light_state(self, location):
+        """State of the traffic light at an intersection (True = NS open)."""
+        return self.intersections[location].state_at(self.light_time)
+
+    def light_states(self, t=None):
+        """States of all traffic lights, in intersections order, at time t (default: now)."""
+        t = self.light_time if t is None else t
+        return self.light_initial != ((t // self.light_periods) % 2 == 1)
+
     def sense(self, agent):
-        assert agent in self.agent_states, "Unknown agent!"
+        inputs = self.sense_codes(agent, [0, 0, 0, 0])
+        return {'light': 'green' if inputs[0] == GREEN else 'red', 'oncoming': self.valid_actions[inputs[1]],
+                'left': self.valid_actions[inputs[2]], 'right': self.valid_actions[inputs[3]]}
 
-        state = self.agent_states[agent]
-        location = state['location']
-        heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+    def sense_codes(self, agent, out):
+        """Write sense() inputs as integer codes into out[0:4]: light (RED/GREEN), then oncoming,
+        left and right as indices into valid_actions. Returns out."""
+        assert self.agents[agent.id] is agent, "Unknown agent!"
+
+        location = self.agent_locations[agent.id]
+        heading = self.agent_headings[agent.id]
+        ns_open = self.light_state(self.intersection_list[location])
+        out[0] = GREEN if ns_open == (heading % 2 == 1) else RED  # headings 1 and 3 are NS
 
         # Populate oncoming, left, right
-        oncoming = None
-        left = None
-        right = None
-        for other_agent, other_state in self.agent_states.iteritems():
-            if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
+        oncoming = 0
+        left = 0
+        right = 0
+        for other_state_heading, other_heading in self.cars_at(agent, location):
+            relative = (other_state_heading - heading) % 4  # 1 = turned left of ours, i.e. coming from the right
+            if relative == 0:
                 continue
-            other_heading = other_agent.get_next_waypoint()
-            if (heading[0] * other_state['heading'][0] + heading[1] * other_state['heading'][1]) == -1:
-                if oncoming != 'left':  # we don't want to override oncoming == 'left'
+            if relative == 2:
+                if oncoming != LEFT:  # we don't want to override oncoming == 'left'
                     oncoming = other_heading
-            elif (heading[1] == other_state['heading'][0] and -heading[0] == other_state['heading'][1]):
-                if right != 'forward' and right != 'left':  # we don't want to override right == 'forward or 'left'
+            elif relative == 1:
+                if right != FORWARD and right != LEFT:  # we don't want to override right == 'forward or 'left'
                     right = other_heading
             else:
-                if left != 'forward':  # we don't want to override left == 'forward'
+                if left != FORWARD:  # we don't want to override left == 'forward'
                     left = other_heading
 
-        return {'light': light, 'oncoming': oncoming, 'left': left, 'right': right}
+        out[1] = oncoming
+        out[2] = left
+        out[3] = right
+        return out
+
+    def cars_at(self, agent, location):
+        """Other cars at an intersection index, in creation order (batched dummies first), as (heading index, next waypoint code)."""
+        if self.batched_dummies:
+            for d in self.dummy_order[self.dummy_starts.item(location):self.dummy_starts.item(location + 1)]:
+                yield self.dummy_headings[d], self.dummy_waypoints[d]
+        for other_id in self.occupancy.get(location, ()):
+            if other_id != agent.id:
+                yield self.agent_headings[other_id], self.action_codes[self.agents[other_id].get_next_waypoint()]
+
+    def observe(self, agent, out):
+        """Write the agent's observation as integer codes into out[0:5]: the sense_codes() inputs,
+        then the route planner's next waypoint (which also becomes agent.next_waypoint). Returns out."""
+        agent.next_waypoint = agent.planner.next_waypoint()
+        self.sense_codes(agent, out)
+        out[4] = self.action_codes[agent.next_waypoint]
+        return out
+
+    def step_action(self, action, obs):
+        """One tick in which the primary agent takes action (an index into valid_actions)
+        instead of running its update(). The primary agent needs a route planner.
+
+        Call observe(primary_agent, obs) after reset() for the first observation.
+        Returns (obs, reward, done), with the next observation written into obs.
+        """
+        self.light_time = self.t
+        if self.batched_dummies:
+            self.update_dummies()
+        reward = 0.0
+        done = self.agent_done
+        for i, agent in enumerate(self.agents):
+            if done[i]:
+                continue
+            if agent is self.primary_agent:
+                reward = self.act(agent, self.valid_actions[action])
+            else:
+                agent.update(self.t)
+        self.finish_step()
+        if not self.done:
+            self.observe(self.primary_agent, obs)
+        return obs, reward, self.done
 
     def get_deadline(self, agent):
-        return self.agent_states[agent]['deadline'] if agent is self.primary_agent else None
+        if agent.id is None or self.agent_destinations[agent.id] < 0:
+            return None  # not created yet, or no trip
+        return self.agent_deadlines[agent.id]
+
+    def all_done(self):
+        return bool(self.tracked_agents) and all(self.agent_done[agent.id] for agent in self.tracked_agents)
+
+    def agent_name(self, agent):
+        return "Primary agent" if agent is self.primary_agent else "Agent {}".format(agent.id)
 
     def act(self, agent, action):
-        assert agent in self.agent_states, "Unknown agent!"
+        assert self.agents[agent.id] is agent, "Unknown agent!"
         assert action in self.valid_actions, "Invalid action!"
 
-        state = self.agent_states[agent]
-        location = state['location']
-        heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
-        inputs = self.sense(agent)
+        i = agent.id
+        retired = self.agent_done[i]  # already done this trial (see retire)
+        location = self.agent_locations[i]
+        heading = self.agent_headings[i]
+        inputs = self.sense_codes(agent, self.act_inputs)
+        green = inputs[0] == GREEN
 
         # Move agent if within bounds and obeys traffic rules
         reward = 0  # reward/penalty
         move_okay = True
         if action == 'forward':
-            if light != 'green':
+            if not green:
                 move_okay = False
         elif action == 'left':
-            if light == 'green' and (inputs['oncoming'] == None or inputs['oncoming'] == 'left'):
-                heading = (heading[1], -heading[0])
+            if green and (inputs[1] == NONE or inputs[1] == LEFT):
+                heading = (heading + 1) % 4
             else:
                 move_okay = False
         elif action == 'right':
-            if light == 'green' or inputs['left'] != 'forward':
-                heading = (-heading[1], heading[0])
+            if green or inputs[2] != FORWARD:
+                heading = (heading - 1) % 4
             else:
                 move_okay = False
 
@@ -198,11 +539,12 @@ class Environment(object):
             # Valid move (could be null)
             if action is not None:
                 # Valid non-null move
-                location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
-                            (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
-                #if self.bounds[0] <= location[0] <= self.bounds[2] and self.bounds[1] <= location[1] <= self.bounds[3]:  # bounded
-                state['location'] = location
-                state['heading'] = heading
+                location = self.neighbors.item(location, heading)  # wrap-around
+                if not retired:  # retired agents stay off the road
+                    self.vacate(agent, self.agent_locations[i])
+                    self.occupy(agent, location)
+                self.agent_locations[i] = location
+                self.agent_headings[i] = heading
                 reward = 2.0 if action == agent.get_next_waypoint() else -0.5  # valid, but is it correct? (as per waypoint)
             else:
                 # Valid null move
@@ -212,14 +554,25 @@ class Environment(object):
             reward = -1.0
             self.penalty += 1
 
+        deadline = self.agent_deadlines[i]
+        reached = not retired and self.agent_destinations[i] == self.agent_locations[i]  # only tracked agents have one
+        if reached:
+            if deadline >= 0:
+                reward += 10  # bonus
+            self.retire(agent)
+            self.done = self.all_done()
+            self.win += 1
+            if self.verbose:
+                print "Environment.act(): {} has reached destination!".format(self.agent_name(agent)) # [debug]
         if agent is self.primary_agent:
-            if state['location'] == state['destination']:
-                if state['deadline'] >= 0:
-                    reward += 10  # bonus
-                self.done = True
-                self.win += 1
-                print "Environment.act(): Primary agent has reached destination!" # [debug]
-            self.status_text = "state: {}\naction: {}\nreward: {}".format(agent.get_state(), action, reward)
+            if self.metrics is not None:
+                self.metrics.record_step(reward, not move_okay)
+            if self.telemetry is not None:
+                self.telemetry.record_step(self.trial, self.t, self.intersection_list[self.agent_locations[i]], self.action_codes[action], reward, deadline, not move_okay)
+                if reached:
+                    self.telemetry.record_trial(self.trial, self.t + 1, telemetry.WIN, deadline)
+            if self.show_status:
+                self.status_text = "state: {}\naction: {}\nreward: {}".format(agent.get_state(), action, reward)
             #print "Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}".format(location, heading, action, reward)  # [debug]
 
         return reward
@@ -232,8 +585,12 @@ class Environment(object):
 class Agent(object):
     """Base class for all agents."""
 
+    __slots__ = ('env', 'id', 'random', 'state', 'next_waypoint', 'color')  # no per-agent __dict__; subclasses declare their own
+
     def __init__(self, env):
         self.env = env
+        self.id = None  # set by Environment.create_agent
+        self.random = env.random  # shares the environment's stream unless a subclass spawns its own
         self.state = None
         self.next_waypoint = None
         self.color = 'cyan'
@@ -252,12 +609,13 @@ class Agent(object):
 
 
 class DummyAgent(Agent):
+    __slots__ = ()
     color_choices = ['blue', 'cyan', 'magenta', 'orange']
 
     def __init__(self, env):
         super(DummyAgent, self).__init__(env)  # sets self.env = env, state = None, next_waypoint = None, and a default color
-        self.next_waypoint = random.choice(Environment.valid_actions[1:])
-        self.color = random.choice(self.color_choices)
+        self.next_waypoint = self.random.choice(Environment.valid_actions[1:])
+        self.color = self.random.choice(self.color_choices)
 
     def update(self, t):
         inputs = self.env.sense(self)
@@ -276,7 +634,7 @@ class DummyAgent(Agent):
         action = None
         if action_okay:
             action = self.next_waypoint
-            self.next_waypoint = random.choice(Environment.valid_actions[1:])
+            self.next_waypoint = self.random.choice(Environment.valid_actions[1:])
         reward = self.env.act(self, action)
         #print "DummyAgent.update(): t = {}, inputs = {}, action = {}, reward = {}".format(t, inputs, action, reward)  # [debug]
         #print "DummyAgent.update(): next_waypoint = {}".format(self.next_waypoint)  # [debug]
@@ -0,0 +1,92 @@
+import math
+import multiprocessing
+import numpy as np
+from environment import Environment
+from simulator import Simulator
+from QLearningAgent import LearningAgent
+from seeding import split_seed
+
+z = 1.96  # 95% confidence
+
+
+def evaluate_seed(params):
+    """Run n_trials greedy trials with a frozen Q-table; returns per-trial (success, penalties, steps)."""
+    path, seed, n_trials, env_kwargs = params
+    e = Environment(seed=seed, **env_kwargs)
+    a = e.create_agent(LearningAgent, epsilon=0.0)  # always greedy
+    a.load(path, mmap=True)  # read-only and shared between workers; turns learning off
+    e.set_primary_agent(a, enforce_deadline=True)
+    sim = Simulator(e, update_delay=0.0, display=False)
+
+    results = np.zeros((n_trials, 3), dtype=np.int64)
+    for trial in xrange(n_trials):
+        win, penalty = e.win, e.penalty
+        sim.run(n_trials=1)
+        results[trial] = (e.win - win, e.penalty - penalty, a.num_moves)
+    return results
+
+
+def wilson_interval(successes, n):
+    """95% Wilson score interval for a proportion."""
+    if n == 0:
+        return (0.0, 1.0)
+    p = float(successes) / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return (center - half, center + half)
+
+
+def mean_interval(values):
+    """Mean and 95% normal-approximation interval."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return float('nan'), (float('nan'), float('nan'))
+    mean = values.mean()
+    half = z * values.std(ddof=1) / math.sqrt(len(values)) if len(values) > 1 else float('inf')
+    return mean, (mean - half, mean + half)
+
+
+def evaluate(path, n_trials=1000, n_seeds=None, processes=None, seed=0, **env_kwargs):
+    """Evaluate the greedy policy of a saved Q-table (see LearningAgent.save).
+
+    Trials are split over n_seeds environments (default: one per core) with independent
+    streams split from seed, run in a process pool. env_kwargs are passed to Environment.
+    Returns a dict with success rate, penalty rate (per move) and mean steps to goal
+    (over successful trials), each with a 95% confidence interval.
+    """
+    n_seeds = n_seeds or multiprocessing.cpu_count()
+    counts = [n_trials // n_seeds + (1 if i < n_trials % n_seeds else 0) for i in xrange(n_seeds)]
+    tasks = [(path, child, count, env_kwargs) for child, count in zip(split_seed(seed, n_seeds), counts) if count > 0]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = np.concatenate(pool.map(evaluate_seed, tasks, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+
+    success, penalties, steps = results[:, 0], results[:, 1], results[:, 2]
+    steps_to_goal, steps_interval = mean_interval(steps[success == 1])
+    return {
+        'trials': len(results),
+        'success_rate': success.mean(),
+        'success_interval': wilson_interval(success.sum(), len(success)),
+        'penalty_rate': float(penalties.sum()) / steps.sum(),
+        'penalty_interval': wilson_interval(penalties.sum(), steps.sum()),
+        'steps_to_goal': steps_to_goal,
+        'steps_interval': steps_interval}
+
+
+def format_report(report):
+    return "\n".join([
+        "Trials: {}".format(report['trials']),
+        "Success rate: {:.3f} [{:.3f}, {:.3f}]".format(report['success_rate'], *report['success_interval']),
+        "Penalty rate: {:.4f} [{:.4f}, {:.4f}] per move".format(report['penalty_rate'], *report['penalty_interval']),
+        "Steps to goal: {:.2f} [{:.2f}, {:.2f}]".format(report['steps_to_goal'], *report['steps_interval'])])
+
+
+def run(path='Q.npy'):
+    """Evaluate a Q-table saved by QLearningAgent.run(save=...)."""
+    print format_report(evaluate(path))
+
+if __name__ == '__main__':
+    run()
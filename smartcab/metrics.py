@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class LearningCurve(object):
+    """Streaming per-trial learning metrics of the primary agent, in O(window) memory.
+
+    Keeps the last window trials' success, penalties, reward, steps to goal and deadline
+    slack (deadline left on arrival; both only for successful trials), and every `every`
+    trials appends their rolling means to a compact time series (see fields).
+    With a target success rate, converged() tells when training can stop early.
+    """
+
+    fields = ['trial', 'success_rate', 'penalties', 'reward', 'steps_to_goal', 'slack']
+
+    def __init__(self, window=100, every=10, target=None):
+        self.window = window
+        self.every = every  # trials between time series points
+        self.target = target  # rolling success rate that counts as converged
+
+        self.recent = np.full((window, len(self.fields) - 1), np.nan)  # ring buffer of per-trial values
+        self.n_trials = 0
+        self.last_trial = -1  # Environment.trial of the last recorded trial
+        self.series = []  # rolling means every `every` trials, rows as in fields
+
+        # Running totals for the current trial
+        self.trial_reward = 0.0
+        self.trial_penalties = 0
+        self.trial_steps = 0
+
+    def record_step(self, reward, penalty=False):
+        self.trial_reward += reward
+        self.trial_penalties += penalty
+        self.trial_steps += 1
+
+    def record_trial(self, trial, success, slack):
+        self.recent[self.n_trials % self.window] = (success, self.trial_penalties, self.trial_reward,
+                                                    self.trial_steps if success else np.nan, slack if success else np.nan)
+        self.n_trials += 1
+        self.last_trial = trial
+        if self.n_trials % self.every == 0:
+            self.series.append((trial,) + self.rolling())
+        self.trial_reward = 0.0
+        self.trial_penalties = 0
+        self.trial_steps = 0
+
+    def rolling(self):
+        """Means over the last window trials, as a tuple ordered as fields[1:] (NaN if none apply)."""
+        recent = self.recent[:min(self.n_trials, self.window)]
+        seen = ~np.isnan(recent)
+        counts = seen.sum(axis=0)
+        totals = np.where(seen, recent, 0.0).sum(axis=0)
+        return tuple(np.where(counts > 0, totals / np.maximum(counts, 1), np.nan))
+
+    def converged(self):
+        """True once a full window of trials reaches the target success rate."""
+        return self.target is not None and self.n_trials >= self.window and self.rolling()[0] >= self.target
+
+    def to_array(self):
+        """Time series as an array with one row per point and columns as in fields."""
+        return np.array(self.series, dtype=np.float64).reshape(-1, len(self.fields))
+
+    def save(self, path):
+        """Write the time series to a '.csv' file, or to an '.npz' file with one array per field."""
+        rows = self.to_array()
+        if path.endswith('.csv'):
+            np.savetxt(path, rows, fmt='%.10g', delimiter=',', header=','.join(self.fields), comments='')
+        else:
+            np.savez(path, **dict((field, rows[:, i]) for i, field in enumerate(self.fields)))
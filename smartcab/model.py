@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class TransitionModel(object):
+    """Tabular model of the smartcab world learned from observed (state, action, reward, next_state) steps.
+
+    States are Q-table rows (see LearningAgent.encode) and actions are action_codes indices.
+    The model keeps transition counts and summed rewards per (s,a) pair, so the estimated
+    P(s'|s,a) and R(s,a) are the empirical frequencies and mean rewards.
+    """
+
+    def __init__(self, num_states, num_actions, np_random=np.random):
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.np_random = np_random  # stream simulated steps are sampled from
+        self.counts = np.zeros((num_states * num_actions, num_states), dtype=np.int32)  # N(s,a,s'), rows indexed by s * num_actions + a
+        self.visits = np.zeros(num_states * num_actions, dtype=np.int64)  # N(s,a)
+        self.reward_sums = np.zeros(num_states * num_actions, dtype=np.float64)
+        self.size = 0  # no. of observed steps
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state):
+        i = state * self.num_actions + action
+        self.counts[i, next_state] += 1
+        self.visits[i] += 1
+        self.reward_sums[i] += reward
+        self.size += 1
+
+    def sample(self, batch_size):
+        """Simulated minibatch: random modelled (s,a) pairs (with replacement), with the mean reward
+        and a next state drawn from P(s'|s,a), as arrays (states, actions, rewards, next_states)."""
+        seen = np.flatnonzero(self.visits)
+        pairs = seen[self.np_random.randint(0, len(seen), size=batch_size)]
+        u = self.np_random.random_sample(batch_size) * self.visits[pairs]
+        next_states = (self.counts[pairs].cumsum(axis=1) <= u[:, None]).sum(axis=1)
+        rewards = self.reward_sums[pairs] / self.visits[pairs]
+        return pairs // self.num_actions, pairs % self.num_actions, rewards, next_states
+
+    def value_iteration(self, Q, gamma, sweeps=1, tol=None):
+        """Update Q in place with sweeps of Q(s,a) = R(s,a) + gamma * sum P(s'|s,a) max Q(s',.) over all modelled pairs.
+
+        Stops early once no value changes by more than tol. Returns the last largest change.
+        """
+        seen = np.flatnonzero(self.visits)
+        if len(seen) == 0:
+            return 0.0
+        states, actions = seen // self.num_actions, seen % self.num_actions
+        P = self.counts[seen] / self.visits[seen, None].astype(np.float64)
+        R = self.reward_sums[seen] / self.visits[seen]
+        delta = 0.0
+        for sweep in xrange(sweeps):
+            values = R + gamma * P.dot(Q.max(axis=1))
+            delta = np.abs(values - Q[states, actions]).max()
+            Q[states, actions] = values
+            if tol is not None and delta <= tol:
+                break
+        return delta
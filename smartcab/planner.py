@@ -1,4 +1,52 @@
-import random
+import numpy as np
+from environment import Environment
+
+
+def route(delta, heading):
+    """Waypoint towards a destination at offset delta = (dx, dy), given the current heading."""
+    if delta[0] == 0 and delta[1] == 0:
+        return None
+    elif delta[0] != 0:  # EW difference
+        if delta[0] * heading[0] > 0:  # facing correct EW direction
+            return 'forward'
+        elif delta[0] * heading[0] < 0:  # facing opposite EW direction
+            return 'right'  # long U-turn
+        elif delta[0] * heading[1] > 0:
+            return 'left'
+        else:
+            return 'right'
+    elif delta[1] != 0:  # NS difference (turn logic is slightly different)
+        if delta[1] * heading[1] > 0:  # facing correct NS direction
+            return 'forward'
+        elif delta[1] * heading[1] < 0:  # facing opposite NS direction
+            return 'right'  # long U-turn
+        elif delta[1] * heading[0] > 0:
+            return 'right'
+        else:
+            return 'left'
+
+
+def sign(v):
+    return 1 if v > 0 else -1 if v < 0 else 0
+
+
+# The waypoint only depends on the signs of delta, so precompute it for every (sign dx, sign dy, heading)
+waypoint_table = dict(((sx, sy, heading), route((sx, sy), heading))
+                      for sx in (-1, 0, 1) for sy in (-1, 0, 1) for heading in Environment.valid_headings)
+# Same table as indices into Environment.valid_actions, indexed by [sign dx + 1, sign dy + 1, heading index]
+waypoint_codes = np.array([[[Environment.valid_actions.index(route((sx, sy), heading)) for heading in Environment.valid_headings]
+                            for sy in (-1, 0, 1)] for sx in (-1, 0, 1)], dtype=np.int64)
+
+
+def next_waypoints(locations, headings, destinations):
+    """Batched next_waypoint.
+
+    locations and destinations are (n, 2) arrays, headings are indices into Environment.valid_headings.
+    Returns waypoints as indices into Environment.valid_actions.
+    """
+    delta = np.sign(np.asarray(destinations) - np.asarray(locations))
+    return waypoint_codes[delta[..., 0] + 1, delta[..., 1] + 1, headings]
+
 
 class RoutePlanner(object):
     """Silly route planner that is meant for a perpendicular grid network."""
@@ -9,30 +57,11 @@ class RoutePlanner(object):
         self.destination = None
 
     def route_to(self, destination=None):
-        self.destination = destination if destination is not None else random.choice(self.env.intersections.keys())
+        self.destination = destination if destination is not None else self.agent.random.choice(self.env.intersection_list)
         #print "RoutePlanner.route_to(): destination = {}".format(destination)  # [debug]
 
     def next_waypoint(self):
-        location = self.env.agent_states[self.agent]['location']
-        heading = self.env.agent_states[self.agent]['heading']
-        delta = (self.destination[0] - location[0], self.destination[1] - location[1])
-        if delta[0] == 0 and delta[1] == 0:
-            return None
-        elif delta[0] != 0:  # EW difference
-            if delta[0] * heading[0] > 0:  # facing correct EW direction
-                return 'forward'
-            elif delta[0] * heading[0] < 0:  # facing opposite EW direction
-                return 'right'  # long U-turn
-            elif delta[0] * heading[1] > 0:
-                return 'left'
-            else:
-                return 'right'
-        elif delta[1] != 0:  # NS difference (turn logic is slightly different)
-            if delta[1] * heading[1] > 0:  # facing correct NS direction
-                return 'forward'
-            elif delta[1] * heading[1] < 0:  # facing opposite NS direction
-                return 'right'  # long U-turn
-            elif delta[1] * heading[0] > 0:
-                return 'right'
-            else:
-                return 'left'
+        env = self.env
+        location = env.intersection_list[env.agent_locations[self.agent.id]]
+        heading = env.valid_headings[env.agent_headings[self.agent.id]]
+        return waypoint_table[sign(self.destination[0] - location[0]), sign(self.destination[1] - location[1]), heading]
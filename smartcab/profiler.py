@@ -0,0 +1,39 @@
+from timeit import default_timer as timer
+
+
+class PhaseProfiler(object):
+    """Accumulates wall time and call counts for each phase of a simulation."""
+
+    def __init__(self):
+        self.times = {}  # phase -> total seconds
+        self.counts = {}  # phase -> no. of calls
+
+    def reset(self):
+        self.times = {}
+        self.counts = {}
+
+    def add(self, phase, elapsed):
+        self.times[phase] = self.times.get(phase, 0.0) + elapsed
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def wrap(self, phase, func):
+        """Wrap func so that each call is timed as phase."""
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(phase, timer() - start)
+        return timed
+
+    def stats(self):
+        """Dict of phase -> {'time', 'calls', 'mean'} (seconds)."""
+        return dict((phase, {'time': self.times[phase], 'calls': self.counts[phase], 'mean': self.times[phase] / self.counts[phase]})
+                    for phase in self.times)
+
+    def report(self):
+        """Text table of phases, most time first."""
+        lines = ["{:<10} {:>10} {:>10} {:>12}".format('phase', 'time (s)', 'calls', 'mean (us)')]
+        for phase in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append("{:<10} {:>10.4f} {:>10} {:>12.2f}".format(phase, self.times[phase], self.counts[phase], 1e6 * self.times[phase] / self.counts[phase]))
+        return '\n'.join(lines)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+
+class HashedStateIndex(object):
+    """Maps arbitrary states to rows of a fixed-size Q-table by feature hashing.
+
+    States are hashable keys, e.g. tuples of ints (avoid None, whose hash varies between runs).
+    Colliding states share a row, so memory stays fixed however many states are seen.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.capacity
+
+    def index(self, state, evict=True):
+        # Hashing never evicts; evict is accepted for LRUStateIndex compatibility
+        return hash(state) % self.capacity
+
+
+class LRUStateIndex(object):
+    """Maps arbitrary states to rows of a fixed-size Q-table, one row per state.
+
+    When all rows are taken, the least recently used state is evicted and its row is
+    handed to the new state, after calling on_evict(row) so the owner can reset it.
+    The map is part of the learned table: save it with items() and load it with restore().
+    """
+
+    def __init__(self, capacity, on_evict=None):
+        self.capacity = capacity
+        self.on_evict = on_evict
+        self.rows = OrderedDict()  # state -> row, least recently used first
+        self.evictions = 0
+
+    def __len__(self):
+        return self.capacity
+
+    def index(self, state, evict=True):
+        """Row of state. With evict=False (e.g. a read-only table), an unknown state is
+        not given a row and None is returned instead."""
+        row = self.rows.pop(state, None)
+        if row is None:
+            if not evict:
+                return None
+            if len(self.rows) < self.capacity:
+                row = len(self.rows)
+            else:
+                evicted, row = self.rows.popitem(last=False)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(row)
+        self.rows[state] = row
+        return row
+
+    def items(self):
+        """(state, row) pairs, least recently used first."""
+        return self.rows.items()
+
+    def restore(self, items):
+        """Replace the map with (state, row) pairs from items()."""
+        self.rows = OrderedDict(items)
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """Fixed-size ring buffer of (state, action, reward, next_state) transitions.
+
+    States are Q-table rows (see LearningAgent.encode) and actions are action_codes indices.
+    Once full, new transitions overwrite the oldest ones, so memory stays bounded.
+    """
+
+    def __init__(self, capacity, np_random=np.random):
+        self.capacity = capacity
+        self.np_random = np_random  # stream minibatches are sampled from
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.size = 0  # no. of stored transitions
+        self.position = 0  # where the next transition goes
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """Random minibatch (with replacement) as arrays (states, actions, rewards, next_states)."""
+        i = self.np_random.randint(0, self.size, size=batch_size)
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i]
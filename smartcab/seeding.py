@@ -0,0 +1,24 @@
+import random
+import hashlib
+import numpy as np
+
+
+def child_seed(seed, i):
+    """Seed of the i-th child stream of seed (e.g. for a worker or an agent), in [0, 2**32)."""
+    return int(hashlib.md5("{}:{}".format(seed, i)).hexdigest()[:8], 16)
+
+
+def split_seed(seed, n):
+    """n independent child seeds of seed, for parallel workers."""
+    return [child_seed(seed, i) for i in xrange(n)]
+
+
+def make_rngs(seed):
+    """A (random.Random, np.random.RandomState) pair of streams seeded from seed.
+
+    With seed None, the global random and np.random modules are returned instead, so
+    unseeded runs share (and can still be seeded through) the global streams.
+    """
+    if seed is None:
+        return random, np.random
+    return random.Random(seed), np.random.RandomState(child_seed(seed, 'numpy'))
@@ -2,11 +2,15 @@ import os
 import time
 import random
 import importlib
+from profiler import PhaseProfiler
 
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
 
     Uses PyGame to display GUI, if available.
+    Frames can also be recorded, with or without a window, every frame_skip steps:
+    record is either a file name pattern for an image sequence (e.g. 'frames/{:05d}.png'),
+    or the name of a raw file that frames are appended to as (height, width, 3) RGB bytes.
     """
 
     colors = {
@@ -21,7 +25,7 @@ class Simulator(object):
         'orange'  : (255, 128,   0)
     }
 
-    def __init__(self, env, size=None, update_delay=1.0, display=True):
+    def __init__(self, env, size=None, update_delay=1.0, display=True, record=None, frame_skip=1, verbose=None, profile=False):
         self.env = env
         self.size = size if size is not None else ((self.env.grid_size[0] + 1) * self.env.block_size, (self.env.grid_size[1] + 1) * self.env.block_size)
         self.width, self.height = self.size
@@ -37,30 +41,65 @@ class Simulator(object):
         self.update_delay = update_delay  # duration between each step (in secs)
 
         self.display = display
-        if self.display:
+        if verbose is not None:
+            self.env.verbose = verbose  # otherwise keep the environment's own setting
+        self.env.show_status = self.env.verbose or display or record is not None  # status text is drawn on screen and recorded frames
+        self.record = record  # image file name pattern or raw frame file (see class docstring)
+        self.frame_skip = frame_skip  # record a frame every frame_skip steps
+        self.frame_count = 0
+        self.frame_file = None
+        if self.display or self.record is not None:
             try:
                 self.pygame = importlib.import_module('pygame')
                 self.pygame.init()
-                self.screen = self.pygame.display.set_mode(self.size)
+                if self.display:
+                    self.screen = self.pygame.display.set_mode(self.size)
+                else:
+                    self.screen = self.pygame.Surface(self.size, 0, 32)  # offscreen, 32-bit (the dummy video driver defaults to 8-bit)
 
                 self.frame_delay = max(1, int(self.update_delay * 1000))  # delay between GUI frames in ms (min: 1)
                 self.agent_sprite_size = (32, 32)
                 self.agent_circle_radius = 10  # radius of circle, when using simple representation
-                for agent in self.env.agent_states:
-                    agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
-                    agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
+                # Pre-rotated sprites, one per heading (images face east), shared by all cars of a color
+                colors = set(agent.color for agent in self.env.agents)
+                if self.env.batched_dummies:
+                    colors.update(self.env.dummy_colors)  # see Environment.update_dummies
+                self.color_sprites = {}
+                for color in colors:
+                    sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(color))), self.agent_sprite_size)
+                    self.color_sprites[color] = dict((heading, sprite if heading == (1, 0) else self.pygame.transform.rotate(sprite, 180 if heading[0] == -1 else heading[1] * -90))
+                                                     for heading in self.env.valid_headings)
 
                 self.font = self.pygame.font.Font(None, 28)
                 self.paused = False
+
+                # Render caches: static background, text surfaces, drawn light states and regions to restore next frame
+                self.background = None
+                self.text_cache = {}  # waypoint labels only; status text changes every step
+                self.drawn_lights = None
+                self.dirty_rects = []
             except ImportError as e:
                 self.display = False
-                print "Simulator.__init__(): Unable to import pygame; display disabled.\n{}: {}".format(e.__class__.__name__, e)
+                self.record = None
+                print "Simulator.__init__(): Unable to import pygame; display and recording disabled.\n{}: {}".format(e.__class__.__name__, e)
             except Exception as e:
                 self.display = False
-                print "Simulator.__init__(): Error initializing GUI objects; display disabled.\n{}: {}".format(e.__class__.__name__, e)
+                self.record = None
+                print "Simulator.__init__(): Error initializing GUI objects; display and recording disabled.\n{}: {}".format(e.__class__.__name__, e)
+
+        # Per-phase timing of steps and rendering, reported at the end of run()
+        self.profiler = None
+        if profile:
+            self.profiler = PhaseProfiler()
+            self.env.enable_profiling(self.profiler)
+            self.render = self.profiler.wrap('render', self.render)
+
+    def run(self, n_trials=1, max_steps=None):
+        if not self.display and self.update_delay <= 0:
+            return self.run_headless(n_trials=n_trials, max_steps=max_steps)
 
-    def run(self, n_trials=1):
         self.quit = False
+        n_steps = 0
         for trial in xrange(n_trials):
             #print "Simulator.run(): Trial {}".format(trial)  # [debug]
             self.env.reset()
@@ -91,6 +130,10 @@ class Simulator(object):
                     if self.current_time - self.last_updated >= self.update_delay:
                         self.env.step()
                         self.last_updated = self.current_time
+                        n_steps += 1
+                        self.record_step(n_steps)
+                        if max_steps is not None and n_steps >= max_steps:
+                            self.quit = True
 
                     # Render GUI and sleep
                     if self.display:
@@ -102,59 +145,231 @@ class Simulator(object):
                     if self.quit or self.env.done:
                         break
 
-            if self.quit:
+            if self.end_trial():
                 break
 
-    def render(self):
-        # Clear screen
-        self.screen.fill(self.bg_color)
+        self.close()
+        if self.profiler is not None:
+            print self.profiler.report()
+        return n_steps
+
+    def run_headless(self, n_trials=1, max_steps=None):
+        """Step the environment as fast as possible, without GUI or wall-clock checks.
+
+        Stops after n_trials trials or max_steps total steps, whichever comes first.
+        Returns the number of steps taken.
+        """
+        self.quit = False
+        env = self.env
+        n_steps = 0
+        try:
+            for trial in xrange(n_trials):
+                env.reset()
+                while not env.done:
+                    env.step()
+                    n_steps += 1
+                    if self.record is not None:
+                        self.record_step(n_steps)
+                    if max_steps is not None and n_steps >= max_steps:
+                        self.quit = True
+                        break
+                if self.end_trial():
+                    break
+        except KeyboardInterrupt:
+            self.quit = True
+        self.close()
+        if self.profiler is not None:
+            print self.profiler.report()
+        return n_steps
+
+    def replay(self, trace):
+        """Show a recorded trial (a tracefile.TrialTrace) tick by tick, without running any agent logic.
+
+        The environment must have the same cars and grid as when the trace was recorded. Its traffic
+        lights are restored afterwards, but car positions are not, so reset() it before simulating
+        again. Frames are recorded as in run().
+        """
+        env = self.env
+        n_dummies = env.num_dummies if env.batched_dummies else 0
+        assert len(trace.destinations) == n_dummies + len(env.agents), "Trace does not match the environment!"
+        assert len(trace.light_initial) == len(env.intersection_list), "Trace does not match the environment!"
+        assert self.display or self.record is not None, "Nothing to replay to (needs display or record)!"
+        lights = env.light_initial, env.light_periods, env.light_time
+        env.light_initial = trace.light_initial
+        env.light_periods = trace.light_periods
+        for i in xrange(len(env.agents)):
+            env.agent_destinations[i] = trace.destinations[n_dummies + i]
+
+        self.quit = False
+        try:
+            for tick in xrange(len(trace)):
+                env.light_time = trace.light_times[tick]
+                locations, headings, waypoints = trace.locations[tick], trace.headings[tick], trace.waypoints[tick]
+                if n_dummies:
+                    env.dummy_locations = locations[:n_dummies]
+                    env.dummy_headings = headings[:n_dummies]
+                    env.dummy_waypoints = waypoints[:n_dummies]
+                for i, agent in enumerate(env.agents):
+                    env.agent_locations[i] = locations[n_dummies + i]
+                    env.agent_headings[i] = headings[n_dummies + i]
+                    agent.next_waypoint = env.valid_actions[waypoints[n_dummies + i]]
+                env.status_text = "replay: trial {}, tick {}".format(trace.trial, tick)
+
+                self.render()
+                if self.record is not None:
+                    self.save_frame()
+                if self.display:
+                    for event in self.pygame.event.get():
+                        if event.type == self.pygame.QUIT or (event.type == self.pygame.KEYDOWN and event.key == 27):  # Esc
+                            self.quit = True
+                    if self.quit:
+                        break
+                    self.pygame.time.wait(self.frame_delay)
+        finally:
+            env.light_initial, env.light_periods, env.light_time = lights  # TrafficLight objects were never touched
+            self.close()
+
+    def end_trial(self):
+        """Record the trial just run in the environment's metrics; True if the run should stop
+        (quit, or the metrics reached their target)."""
+        self.env.end_trial()
+        metrics = self.env.metrics
+        return self.quit or (metrics is not None and metrics.converged())
+
+    def close(self):
+        """Close the raw frame file and the environment's telemetry sink, if any; called at the end of run() and replay()."""
+        if self.frame_file is not None:
+            self.frame_file.close()
+            self.frame_file = None
+        if self.env.telemetry is not None:
+            self.env.telemetry.close()
+
+    def record_step(self, n_steps):
+        """Render and save a frame if recording and this step is one of every frame_skip steps."""
+        if self.record is not None and n_steps % self.frame_skip == 0:
+            self.render()
+            self.save_frame()
 
-        # Draw elements
-        # * Static elements
+    def save_frame(self):
+        if '{' in self.record:
+            self.pygame.image.save(self.screen, self.record.format(self.frame_count))
+        else:
+            if self.frame_file is None:
+                self.frame_file = open(self.record, 'ab' if self.frame_count else 'wb')  # reopened after close(), keep appending
+            self.frame_file.write(self.pygame.image.tostring(self.screen, 'RGB'))
+        self.frame_count += 1
+
+    def render_background(self):
+        """Render the static road network (roads and intersections) to a new surface."""
+        background = self.pygame.Surface(self.size, 0, 32)
+        if self.display:
+            background = background.convert()
+        background.fill(self.bg_color)
         for road in self.env.roads:
-            self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
-
-        for intersection, traffic_light in self.env.intersections.iteritems():
-            self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), 10)
-            if traffic_light.state:  # North-South is open
-                self.pygame.draw.line(self.screen, self.colors['green'],
-                    (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size - 15),
-                    (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size + 15), self.road_width)
+            self.pygame.draw.line(background, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+        for intersection in self.env.intersection_list:
+            self.pygame.draw.circle(background, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), 10)
+        return background
+
+    def render_text(self, text, color):
+        surface = self.text_cache.get((text, color))
+        if surface is None:
+            surface = self.text_cache[(text, color)] = self.font.render(text, True, color, self.bg_color)
+        return surface
+
+    def render(self):
+        # Draw on top of the cached background, redrawing only what changed since the last frame
+        full_update = self.background is None
+        if full_update:
+            self.background = self.render_background()
+            self.screen.blit(self.background, (0, 0))
+            self.drawn_lights = None
+            self.dirty_rects = []
+
+        # Restore regions drawn over in the last frame
+        restored = self.dirty_rects
+        for rect in restored:
+            self.screen.blit(self.background, rect, rect)
+        self.dirty_rects = []
+
+        # * Traffic lights, where they switched or were drawn over
+        light_states = self.env.light_states()
+        if self.drawn_lights is None:
+            redraw = range(len(light_states))
+        else:
+            redraw = set((light_states != self.drawn_lights).nonzero()[0])
+            for rect in restored:
+                redraw.update(self.intersections_near(rect))
+        for i in redraw:
+            intersection = self.env.intersection_list[i]
+            center = (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size)
+            rect = self.pygame.rect.Rect(center[0] - 15 - self.road_width, center[1] - 15 - self.road_width, 30 + 2 * self.road_width, 30 + 2 * self.road_width)
+            self.screen.blit(self.background, rect, rect)
+            if light_states[i]:  # North-South is open
+                self.pygame.draw.line(self.screen, self.colors['green'], (center[0], center[1] - 15), (center[0], center[1] + 15), self.road_width)
             else:  # East-West is open
-                self.pygame.draw.line(self.screen, self.colors['green'],
-                    (intersection[0] * self.env.block_size - 15, intersection[1] * self.env.block_size),
-                    (intersection[0] * self.env.block_size + 15, intersection[1] * self.env.block_size), self.road_width)
+                self.pygame.draw.line(self.screen, self.colors['green'], (center[0] - 15, center[1]), (center[0] + 15, center[1]), self.road_width)
+            restored.append(rect)
+        self.drawn_lights = light_states
 
         # * Dynamic elements
-        for agent, state in self.env.agent_states.iteritems():
-            # Compute precise agent location here (back from the intersection some)
-            agent_offset = (2 * state['heading'][0] * self.agent_circle_radius, 2 * state['heading'][1] * self.agent_circle_radius)
-            agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
-            agent_color = self.colors[agent.color]
-            if hasattr(agent, '_sprite') and agent._sprite is not None:
-                # Draw agent sprite (image), properly rotated
-                rotated_sprite = agent._sprite if state['heading'] == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if state['heading'][0] == -1 else state['heading'][1] * -90)
-                self.screen.blit(rotated_sprite,
-                    self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
-                        agent._sprite_size[0], agent._sprite_size[1]))
-            else:
-                # Draw simple agent (circle with a short line segment poking out to indicate heading)
-                self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
-                self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
-            if agent.get_next_waypoint() is not None:
-                self.screen.blit(self.font.render(agent.get_next_waypoint(), True, agent_color, self.bg_color), (agent_pos[0] + 10, agent_pos[1] + 10))
-            if state['destination'] is not None:
-                self.pygame.draw.circle(self.screen, agent_color, (state['destination'][0] * self.env.block_size, state['destination'][1] * self.env.block_size), 6)
-                self.pygame.draw.circle(self.screen, agent_color, (state['destination'][0] * self.env.block_size, state['destination'][1] * self.env.block_size), 15, 2)
+        if self.env.batched_dummies:
+            for location, heading, waypoint, color in zip(self.env.dummy_locations, self.env.dummy_headings, self.env.dummy_waypoints, self.env.dummy_colors):
+                self.draw_agent(self.env.intersection_list[location], self.env.valid_headings[heading], color,
+                                self.color_sprites.get(color), self.agent_sprite_size, self.env.valid_actions[waypoint], None)
+        env = self.env
+        for i, agent in enumerate(env.agents):
+            destination = env.agent_destinations[i]
+            self.draw_agent(env.intersection_list[env.agent_locations[i]], env.valid_headings[env.agent_headings[i]], agent.color,
+                            self.color_sprites.get(agent.color), self.agent_sprite_size, agent.get_next_waypoint(),
+                            env.intersection_list[destination] if destination >= 0 else None)
 
         # * Overlays
+        dirty = self.dirty_rects
         text_y = 10
         for text in self.env.status_text.split('\n'):
-            self.screen.blit(self.font.render(text, True, self.colors['red'], self.bg_color), (100, text_y))
+            dirty.append(self.screen.blit(self.font.render(text, True, self.colors['red'], self.bg_color), (100, text_y)))
             text_y += 20
 
-        # Flip buffers
-        self.pygame.display.flip()
+        # Flip buffers, or update only the changed regions
+        if not self.display:
+            return  # offscreen
+        if full_update:
+            self.pygame.display.flip()
+        else:
+            self.pygame.display.update(restored + dirty)
+
+    def draw_agent(self, location, heading, color, sprites, sprite_size, waypoint, destination):
+        """Draw one agent, adding the regions drawn over to dirty_rects."""
+        dirty = self.dirty_rects
+        # Compute precise agent location here (back from the intersection some)
+        agent_offset = (2 * heading[0] * self.agent_circle_radius, 2 * heading[1] * self.agent_circle_radius)
+        agent_pos = (location[0] * self.env.block_size - agent_offset[0], location[1] * self.env.block_size - agent_offset[1])
+        agent_color = self.colors[color]
+        if sprites is not None:
+            # Draw agent sprite (image), pre-rotated for the heading
+            dirty.append(self.screen.blit(sprites[heading],
+                self.pygame.rect.Rect(agent_pos[0] - sprite_size[0] / 2, agent_pos[1] - sprite_size[1] / 2,
+                    sprite_size[0], sprite_size[1])))
+        else:
+            # Draw simple agent (circle with a short line segment poking out to indicate heading)
+            dirty.append(self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius))
+            dirty.append(self.pygame.draw.line(self.screen, agent_color, agent_pos, location, self.road_width))
+        if waypoint is not None:
+            dirty.append(self.screen.blit(self.render_text(waypoint, agent_color), (agent_pos[0] + 10, agent_pos[1] + 10)))
+        if destination is not None:
+            dirty.append(self.pygame.draw.circle(self.screen, agent_color, (destination[0] * self.env.block_size, destination[1] * self.env.block_size), 6))
+            dirty.append(self.pygame.draw.circle(self.screen, agent_color, (destination[0] * self.env.block_size, destination[1] * self.env.block_size), 15, 2))
+
+    def intersections_near(self, rect):
+        """Indices of intersections whose traffic light may overlap rect."""
+        margin = 15 + self.road_width
+        cols, rows = self.env.grid_size
+        x0 = max(self.env.bounds[0], -(-(rect.left - margin) // self.env.block_size))
+        x1 = min(self.env.bounds[2], (rect.right + margin) // self.env.block_size)
+        y0 = max(self.env.bounds[1], -(-(rect.top - margin) // self.env.block_size))
+        y1 = min(self.env.bounds[3], (rect.bottom + margin) // self.env.block_size)
+        return [self.env.intersection_index[(x, y)] for x in xrange(x0, x1 + 1) for y in xrange(y0, y1 + 1)]
 
     def pause(self):
         abs_pause_time = time.time()
@@ -167,5 +382,5 @@ class Simulator(object):
                 if event.type == self.pygame.KEYDOWN:
                     self.paused = False
             self.pygame.time.wait(self.frame_delay)
-        self.screen.blit(self.font.render(pause_text, True, self.bg_color, self.bg_color), (100, self.height - 40))
+        self.dirty_rects.append(self.screen.blit(self.font.render(pause_text, True, self.bg_color, self.bg_color), (100, self.height - 40)))
         self.start_time += (time.time() - abs_pause_time)
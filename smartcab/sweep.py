@@ -0,0 +1,60 @@
+import itertools
+import multiprocessing
+from environment import Environment
+from simulator import Simulator
+from QLearningAgent import LearningAgent
+
+columns = ['alpha', 'gamma', 'epsilon', 'deg_epsilon', 'seed', 'win_rate', 'penalty', 'reward', 'moves']
+
+
+def train(params):
+    """Train one LearningAgent configuration headless and return its results row."""
+    alpha, gamma, epsilon, deg_epsilon, seed, n_trials = params
+    e = Environment(seed=seed)
+    a = e.create_agent(LearningAgent, alpha=alpha, gamma=gamma, epsilon=epsilon, deg_epsilon=deg_epsilon)
+    e.set_primary_agent(a, enforce_deadline=True)
+    sim = Simulator(e, update_delay=0.0, display=False)
+
+    # Run trial by trial, since the agent resets its reward and move counts every trial
+    reward = 0.0
+    moves = 0
+    for trial in xrange(n_trials):
+        sim.run(n_trials=1)
+        reward += a.cum_rewards
+        moves += a.num_moves
+
+    return dict(alpha=alpha, gamma=gamma, epsilon=epsilon, deg_epsilon=deg_epsilon, seed=seed,
+                win_rate=float(e.win) / n_trials, penalty=e.penalty, reward=reward, moves=moves)
+
+
+def sweep(alphas, gammas, epsilons, deg_epsilons=(0.01,), n_seeds=5, n_trials=100, processes=None):
+    """Train every grid point with n_seeds seeds across a process pool (default: all cores).
+
+    Returns a list of result rows (dicts keyed by columns), one per grid point and seed.
+    The same seeds are used at every grid point.
+    """
+    grid = [point + (seed, n_trials) for point in itertools.product(alphas, gammas, epsilons, deg_epsilons)
+            for seed in xrange(n_seeds)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(train, grid, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_table(rows):
+    """Format result rows as a fixed-width text table."""
+    lines = [' '.join('{:>11}'.format(c) for c in columns)]
+    for row in rows:
+        lines.append(' '.join('{:>11}'.format(row[c]) for c in columns))
+    return '\n'.join(lines)
+
+
+def run():
+    """Sweep alpha/gamma/epsilon around the defaults of QLearningAgent."""
+    rows = sweep(alphas=[0.2, 0.5, 0.8], gammas=[0.2, 0.4, 0.8], epsilons=[0.0, 0.1, 0.2], n_seeds=3)
+    print format_table(rows)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+
+# Trial outcomes
+WIN, LOSE, ABORT = 1, 2, 3  # reached destination, ran out of time, hit hard time limit
+
+
+class Telemetry(object):
+    """Buffered per-step and per-trial records of the primary agent.
+
+    Records go into preallocated arrays and are written out in bulk when a buffer
+    fills up or on flush()/close(). Paths ending in '.csv' are appended to on every
+    write. '.npz' files hold one array per field: every write appends the raw rows to
+    '<path>.part', and close() rewrites the .npz from it with all records so far.
+    Steps are only stored if steps_path is given; trials only if trials_path is given.
+    """
+
+    step_fields = ['trial', 't', 'x', 'y', 'action', 'reward', 'deadline']  # action indexes Environment.valid_actions
+    trial_fields = ['trial', 'steps', 'outcome', 'deadline', 'reward', 'penalties']
+
+    def __init__(self, steps_path=None, trials_path=None, capacity=4096):
+        self.steps_path = steps_path
+        self.trials_path = trials_path
+        self.capacity = capacity
+
+        self.steps = np.zeros((capacity, len(self.step_fields)))
+        self.trials = np.zeros((capacity, len(self.trial_fields)))
+        self.n_steps = 0  # no. of buffered records
+        self.n_trials = 0
+        self.started = set()  # .csv and .part files already created in this run
+
+        # Running totals for the current trial
+        self.trial_reward = 0.0
+        self.trial_penalties = 0
+
+    def record_step(self, trial, t, location, action, reward, deadline, penalty=False):
+        # action is an index into Environment.valid_actions
+        self.trial_reward += reward
+        self.trial_penalties += penalty
+        if self.steps_path is None:
+            return
+        self.steps[self.n_steps] = (trial, t, location[0], location[1], action, reward, deadline)
+        self.n_steps += 1
+        if self.n_steps == self.capacity:
+            self.flush_steps()
+
+    def record_trial(self, trial, steps, outcome, deadline):
+        if self.trials_path is not None:
+            self.trials[self.n_trials] = (trial, steps, outcome, deadline, self.trial_reward, self.trial_penalties)
+            self.n_trials += 1
+            if self.n_trials == self.capacity:
+                self.flush_trials()
+        self.trial_reward = 0.0
+        self.trial_penalties = 0
+
+    def flush_steps(self):
+        self.write(self.steps_path, self.step_fields, self.steps[:self.n_steps])
+        self.n_steps = 0
+
+    def flush_trials(self):
+        self.write(self.trials_path, self.trial_fields, self.trials[:self.n_trials])
+        self.n_trials = 0
+
+    def flush(self):
+        if self.steps_path is not None:
+            self.flush_steps()
+        if self.trials_path is not None:
+            self.flush_trials()
+
+    def close(self):
+        """Flush buffers and write out .npz files."""
+        self.flush()
+        for path, fields in ((self.steps_path, self.step_fields), (self.trials_path, self.trial_fields)):
+            if path is not None and not path.endswith('.csv'):
+                part = path + '.part'
+                if os.path.exists(part) and os.path.getsize(part):
+                    rows = np.memmap(part, dtype=np.float64, mode='r').reshape(-1, len(fields))  # read one field at a time
+                else:
+                    rows = np.zeros((0, len(fields)))
+                np.savez(path, **dict((field, rows[:, i]) for i, field in enumerate(fields)))
+
+    def write(self, path, fields, rows):
+        new = path not in self.started
+        self.started.add(path)
+        if path.endswith('.csv'):
+            with open(path, 'w' if new else 'a') as f:
+                np.savetxt(f, rows, fmt='%.10g', delimiter=',', header=','.join(fields) if new else '', comments='')
+        else:
+            with open(path + '.part', 'wb' if new else 'ab') as f:
+                rows.astype(np.float64).tofile(f)
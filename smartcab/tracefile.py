@@ -0,0 +1,159 @@
+import os
+import numpy as np
+
+# Each trial is one record in the trace file:
+#   header: int32 [trial, n_ticks, n_cars, n_lights, n_changes]
+#   lights: uint8 initial states and periods (n_lights each); int32 light time of every tick (n_ticks)
+#   cars: int32 destinations, then the first tick's int32 locations, int8 headings and int8 waypoints (n_cars each)
+#   changes: int32 ticks and cars, int32 locations, int8 headings and int8 waypoints (n_changes each),
+#            one per car whose location, heading or waypoint differs from the tick before
+# Cars are batched dummies (if any) followed by agents in id order; locations are intersection indices,
+# headings index Environment.valid_headings and waypoints Environment.valid_actions.
+header_dtype = np.dtype(np.int32)
+
+
+def car_states(env):
+    """(locations, headings, waypoints) of all cars of env, as arrays."""
+    locations = np.frombuffer(env.agent_locations, dtype=np.int32)
+    headings = np.frombuffer(env.agent_headings, dtype=np.int8)
+    waypoints = np.array([env.action_codes[agent.get_next_waypoint()] for agent in env.agents], dtype=np.int8)
+    if env.batched_dummies:
+        locations = np.concatenate((env.dummy_locations, locations))
+        headings = np.concatenate((env.dummy_headings, headings))
+        waypoints = np.concatenate((env.dummy_waypoints, waypoints))
+    return locations.astype(np.int32), headings.astype(np.int8), waypoints.astype(np.int8)
+
+
+class TraceRecorder(object):
+    """Records every tick of every trial of an Environment as a compact binary trace.
+
+    Attach it as env.trace. Ticks are delta-encoded (only cars that changed are stored) and
+    kept in memory until the trial ends, then appended to path as one record. Traffic lights
+    are stored once per trial, since their states follow from the light time of each tick.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.trial = None  # Environment.trial being recorded
+
+    def begin_trial(self, env):
+        self.trial = env.trial
+        self.light_initial = env.light_initial.astype(np.uint8)
+        self.light_periods = env.light_periods.astype(np.uint8)
+        destinations = np.frombuffer(env.agent_destinations, dtype=np.int32)
+        if env.batched_dummies:
+            destinations = np.concatenate((np.full(env.num_dummies, -1, dtype=np.int32), destinations))
+        self.destinations = destinations.astype(np.int32)
+        self.first = self.last = car_states(env)
+        self.light_times = [env.light_time]
+        self.changes = []
+
+    def record_tick(self, env):
+        if self.trial is None:
+            return
+        states = car_states(env)
+        changed = np.flatnonzero((states[0] != self.last[0]) | (states[1] != self.last[1]) | (states[2] != self.last[2]))
+        if len(changed):
+            self.changes.append((np.full(len(changed), len(self.light_times), dtype=np.int32), changed.astype(np.int32),
+                                 states[0][changed], states[1][changed], states[2][changed]))
+        self.light_times.append(env.light_time)
+        self.last = states
+
+    def end_trial(self):
+        if self.trial is None:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'wb')
+        changes = [np.concatenate(field) for field in zip(*self.changes)] if self.changes else \
+            [np.zeros(0, dtype=dtype) for dtype in (np.int32, np.int32, np.int32, np.int8, np.int8)]
+        header = np.array([self.trial, len(self.light_times), len(self.destinations), len(self.light_initial), len(changes[0])], dtype=header_dtype)
+        self.file.write(''.join(a.tobytes() for a in [header, self.light_initial, self.light_periods, np.array(self.light_times, dtype=np.int32),
+                                                       self.destinations] + list(self.first) + changes))
+        self.file.flush()
+        self.trial = None
+        self.changes = []
+
+    def close(self):
+        self.end_trial()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TrialTrace(object):
+    """One recorded trial, with per-tick arrays of shape (n_ticks, n_cars): locations, headings, waypoints."""
+
+    def __init__(self, trial, light_initial, light_periods, light_times, destinations, first, changes):
+        self.trial = trial
+        self.light_initial = light_initial.astype(bool)
+        self.light_periods = light_periods.astype(np.int64)
+        self.light_times = light_times
+        self.destinations = destinations
+
+        # Undo the delta encoding: each (tick, car) takes the value of its latest change,
+        # with the first tick's values as changes 0..n_cars-1 (changes are in tick order)
+        ticks, cars = changes[:2]
+        n_ticks, n_cars = len(light_times), len(destinations)
+        source = np.full((n_ticks, n_cars), -1, dtype=np.int64)
+        source[0] = np.arange(n_cars)
+        source[ticks, cars] = n_cars + np.arange(len(ticks))
+        source = np.maximum.accumulate(source, axis=0)
+        self.locations, self.headings, self.waypoints = [np.concatenate((start, changed))[source] for start, changed in zip(first, changes[2:])]
+
+    def __len__(self):
+        return len(self.light_times)
+
+    def light_states(self, tick):
+        """States of all traffic lights at a tick, in intersections order (see Environment.light_states)."""
+        return self.light_initial != ((self.light_times[tick] // self.light_periods) % 2 == 1)
+
+
+def take(data, offset, dtype, n):
+    """n values of dtype from a byte array at offset; returns (values, offset after them)."""
+    return np.frombuffer(data, dtype=dtype, count=n, offset=offset), offset + n * np.dtype(dtype).itemsize
+
+
+def read_trace(path, trials=None):
+    """Iterate over the trials of a trace file written by TraceRecorder, as TrialTrace objects.
+
+    With trials (a collection of Environment.trial numbers), other trials are skipped without decoding.
+    The file is memory-mapped, so only the trials read are loaded.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    offset = 0
+    while offset < len(data):
+        header, offset = take(data, offset, header_dtype, 5)
+        trial, n_ticks, n_cars, n_lights, n_changes = [int(v) for v in header]
+        size = 2 * n_lights + 4 * n_ticks + (4 + 4 + 1 + 1) * n_cars + (4 + 4 + 4 + 1 + 1) * n_changes
+        if trials is not None and trial not in trials:
+            offset += size
+            continue
+        light_initial, offset = take(data, offset, np.uint8, n_lights)
+        light_periods, offset = take(data, offset, np.uint8, n_lights)
+        light_times, offset = take(data, offset, np.int32, n_ticks)
+        destinations, offset = take(data, offset, np.int32, n_cars)
+        first = []
+        for dtype in (np.int32, np.int8, np.int8):
+            values, offset = take(data, offset, dtype, n_cars)
+            first.append(values)
+        changes = []
+        for dtype in (np.int32, np.int32, np.int32, np.int8, np.int8):
+            values, offset = take(data, offset, dtype, n_changes)
+            changes.append(values)
+        yield TrialTrace(trial, light_initial, light_periods, light_times, destinations, first, changes)
+
+
+def find_trial(path, trial):
+    """The TrialTrace of a given Environment.trial in a trace file, or None."""
+    for trace in read_trace(path, trials=(trial,)):
+        return trace
+    return None
+
+
+def replay(trace, func):
+    """Call func(tick, locations, headings, waypoints, light_states) for every tick of a TrialTrace."""
+    for tick in xrange(len(trace)):
+        func(tick, trace.locations[tick], trace.headings[tick], trace.waypoints[tick], trace.light_states(tick))
@@ -0,0 +1,236 @@
+import numpy as np
+
+from environment import Environment
+from planner import waypoint_codes
+from seeding import make_rngs
+
+
+# Integer codes used by the vectorized environment
+# Actions and waypoints index into Environment.valid_actions: None, 'forward', 'left', 'right'
+NONE, FORWARD, LEFT, RIGHT = 0, 1, 2, 3
+# Lights as seen by an agent
+RED, GREEN = 0, 1
+# Headings index into Environment.valid_headings: E, N, W, S (a left turn is +1, a right turn is -1)
+HEADING_DX = np.array([h[0] for h in Environment.valid_headings], dtype=np.int64)
+HEADING_DY = np.array([h[1] for h in Environment.valid_headings], dtype=np.int64)
+
+
+class VecEnvironment(object):
+    """N independent smartcab worlds simulated together in NumPy arrays.
+
+    Each world mirrors an Environment with num_dummies dummy agents followed by one
+    primary agent, and follows the same traffic rules, rewards and deadline accounting.
+    Agents are updated in the same order as in Environment, so the batch is only
+    vectorized across worlds, never across agents within a world.
+
+    All inputs and outputs are integer codes (see NONE/FORWARD/LEFT/RIGHT, RED/GREEN).
+    Locations are 0-based, i.e. intersection (x, y) of Environment is (x - 1, y - 1) here.
+    """
+
+    valid_actions = Environment.valid_actions
+    valid_headings = Environment.valid_headings
+    hard_time_limit = Environment.hard_time_limit
+
+    def __init__(self, num_envs, num_dummies=3, grid_size=(8, 6), enforce_deadline=False, auto_reset=True, seed=None):
+        self.np_random = make_rngs(seed)[1]  # batched stream for all worlds (global np.random without a seed)
+        self.num_envs = num_envs
+        self.num_dummies = num_dummies
+        self.num_agents = num_dummies + 1
+        self.primary = num_dummies  # primary agent is created last, so it is updated last
+        self.grid_size = grid_size  # (cols, rows)
+        self.enforce_deadline = enforce_deadline
+        self.auto_reset = auto_reset  # reset finished worlds at the end of step()
+
+        n, a = self.num_envs, self.num_agents
+        cols, rows = self.grid_size
+
+        # status report trackers (per world)
+        self.win = np.zeros(n, dtype=np.int64)
+        self.lose = np.zeros(n, dtype=np.int64)
+        self.penalty = np.zeros(n, dtype=np.int64)
+
+        # Simulation variables
+        self.done = np.zeros(n, dtype=bool)
+        self.t = np.zeros(n, dtype=np.int64)
+
+        # Traffic lights: True = NS open, False = EW open; states are computed from light_time on demand
+        self.light_initial = self.np_random.randint(0, 2, size=(n, cols, rows)).astype(bool)  # state at t = 0
+        self.light_period = self.np_random.randint(3, 6, size=(n, cols, rows)).astype(np.int64)
+        self.light_time = np.zeros(n, dtype=np.int64)  # time of the last light update
+
+        # Agents
+        self.x = self.np_random.randint(0, cols, size=(n, a))
+        self.y = self.np_random.randint(0, rows, size=(n, a))
+        self.heading = np.full((n, a), 3, dtype=np.int64)  # (0, 1)
+        self.waypoint = self.np_random.randint(FORWARD, RIGHT + 1, size=(n, a))  # dummies pick a random first waypoint
+        self.waypoint[:, self.primary] = NONE
+        self.dest_x = np.zeros(n, dtype=np.int64)
+        self.dest_y = np.zeros(n, dtype=np.int64)
+        self.deadline = np.zeros(n, dtype=np.int64)
+
+        self._all = np.ones(n, dtype=bool)
+
+    def reset(self, mask=None):
+        """Start a new trial in the worlds selected by mask (default: all)."""
+        mask = self._all if mask is None else np.asarray(mask, dtype=bool)
+        idx = np.flatnonzero(mask)
+        k = len(idx)
+        if k == 0:
+            return
+        cols, rows = self.grid_size
+
+        self.done[idx] = False
+        self.t[idx] = 0
+        self.light_initial[idx] = self.light_states()[idx]  # carry light states over to the new trial
+        self.light_time[idx] = 0
+
+        # Pick a start and a destination, ensuring they are not too close
+        sx = self.np_random.randint(0, cols, size=k)
+        sy = self.np_random.randint(0, rows, size=k)
+        dx = self.np_random.randint(0, cols, size=k)
+        dy = self.np_random.randint(0, rows, size=k)
+        close = (np.abs(dx - sx) + np.abs(dy - sy)) < 4
+        while close.any():
+            m = close.sum()
+            sx[close] = self.np_random.randint(0, cols, size=m)
+            sy[close] = self.np_random.randint(0, rows, size=m)
+            dx[close] = self.np_random.randint(0, cols, size=m)
+            dy[close] = self.np_random.randint(0, rows, size=m)
+            close = (np.abs(dx - sx) + np.abs(dy - sy)) < 4
+
+        # Initialize agents
+        self.x[idx] = self.np_random.randint(0, cols, size=(k, self.num_agents))
+        self.y[idx] = self.np_random.randint(0, rows, size=(k, self.num_agents))
+        self.heading[idx] = self.np_random.randint(0, 4, size=(k, self.num_agents))
+        self.x[idx, self.primary] = sx
+        self.y[idx, self.primary] = sy
+        self.waypoint[idx, self.primary] = NONE
+        self.dest_x[idx] = dx
+        self.dest_y[idx] = dy
+        self.deadline[idx] = (np.abs(dx - sx) + np.abs(dy - sy)) * 5
+
+        self._advance(mask)
+
+    def sense(self, agent=None):
+        """Inputs seen by an agent (default: primary) in every world, as a dict of code arrays."""
+        agent = self.primary if agent is None else agent
+        light, oncoming, left, right = self._sense(agent)
+        return {'light': light, 'oncoming': oncoming, 'left': left, 'right': right}
+
+    def light_states(self):
+        """States of all traffic lights, shape (num_envs, cols, rows) (see TrafficLight.state_at)."""
+        return self.light_initial != ((self.light_time[:, None, None] // self.light_period) % 2 == 1)
+
+    def next_waypoint(self):
+        """Route planner waypoint of the primary agent in every world (see RoutePlanner.next_waypoint)."""
+        p = self.primary
+        return waypoint_codes[np.sign(self.dest_x - self.x[:, p]) + 1, np.sign(self.dest_y - self.y[:, p]) + 1, self.heading[:, p]]
+
+    def act(self, actions, agent=None, mask=None):
+        """Apply one action per world for an agent (default: primary); returns rewards."""
+        agent = self.primary if agent is None else agent
+        mask = ~self.done if mask is None else np.asarray(mask, dtype=bool) & ~self.done
+        actions = np.asarray(actions, dtype=np.int64)
+
+        light, oncoming, left, _ = self._sense(agent)
+        green = light == GREEN
+
+        # Move agent if it obeys traffic rules
+        okay = np.ones(self.num_envs, dtype=bool)
+        okay[(actions == FORWARD) & ~green] = False
+        okay[(actions == LEFT) & ~(green & ((oncoming == NONE) | (oncoming == LEFT)))] = False
+        okay[(actions == RIGHT) & ~(green | (left != FORWARD))] = False
+
+        heading = self.heading[:, agent]
+        heading = np.where(okay & (actions == LEFT), (heading + 1) % 4, heading)
+        heading = np.where(okay & (actions == RIGHT), (heading - 1) % 4, heading)
+
+        moved = mask & okay & (actions != NONE)
+        cols, rows = self.grid_size
+        self.x[moved, agent] = (self.x[moved, agent] + HEADING_DX[heading[moved]]) % cols  # wrap-around
+        self.y[moved, agent] = (self.y[moved, agent] + HEADING_DY[heading[moved]]) % rows
+        self.heading[moved, agent] = heading[moved]
+
+        reward = np.where(actions == NONE, 0.0, np.where(actions == self.waypoint[:, agent], 2.0, -0.5))
+        reward[~okay] = -1.0
+        reward[~mask] = 0.0
+        self.penalty += mask & ~okay
+
+        if agent == self.primary:
+            arrived = mask & (self.x[:, agent] == self.dest_x) & (self.y[:, agent] == self.dest_y)
+            reward[arrived & (self.deadline >= 0)] += 10  # bonus
+            self.done |= arrived
+            self.win += arrived
+
+        return reward
+
+    def step(self, actions):
+        """Primary agents take actions, then all worlds advance one tick.
+
+        Returns (rewards, done) for the actions taken. With auto_reset, finished
+        worlds start a new trial before returning.
+        """
+        live = ~self.done
+        self.waypoint[:, self.primary] = self.next_waypoint()
+        rewards = self.act(actions, mask=live)
+
+        # Deadline accounting for worlds still running
+        running = live & ~self.done
+        hard = running & (self.deadline <= self.hard_time_limit)
+        late = running & ~hard & (self.deadline <= 0) if self.enforce_deadline else np.zeros_like(running)
+        self.done |= hard | late
+        self.lose += late
+        self.deadline[running] -= 1
+        self.t[running] += 1
+
+        done = live & self.done
+        if self.auto_reset and done.any():
+            self.reset(done)
+        self._advance(live & ~done)
+        return rewards, done
+
+    def _sense(self, agent):
+        x, y, heading = self.x[:, agent], self.y[:, agent], self.heading[:, agent]
+        period = self.light_period[np.arange(self.num_envs), x, y]
+        ns_open = self.light_initial[np.arange(self.num_envs), x, y] != ((self.light_time // period) % 2 == 1)
+        light = np.where((heading % 2 == 1) == ns_open, GREEN, RED)
+
+        # Populate oncoming, left, right, in agent order so the same inputs win as in Environment.sense
+        oncoming = np.zeros(self.num_envs, dtype=np.int64)
+        left = np.zeros(self.num_envs, dtype=np.int64)
+        right = np.zeros(self.num_envs, dtype=np.int64)
+        for other in xrange(self.num_agents):
+            if other == agent:
+                continue
+            other_heading = self.heading[:, other]
+            present = (self.x[:, other] == x) & (self.y[:, other] == y) & (other_heading != heading)
+            if not present.any():
+                continue
+            relative = (other_heading - heading) % 4
+            other_waypoint = self.waypoint[:, other]
+            m = present & (relative == 2) & (oncoming != LEFT)
+            oncoming[m] = other_waypoint[m]
+            m = present & (relative == 1) & (right != FORWARD) & (right != LEFT)
+            right[m] = other_waypoint[m]
+            m = present & (relative == 3) & (left != FORWARD)
+            left[m] = other_waypoint[m]
+        return light, oncoming, left, right
+
+    def _advance(self, mask):
+        """First part of a tick in the selected worlds: update traffic lights and dummy agents."""
+        if not mask.any():
+            return
+        self.light_time[mask] = self.t[mask]
+
+        for dummy in xrange(self.num_dummies):
+            light, oncoming, left, _ = self._sense(dummy)
+            waypoint = self.waypoint[:, dummy]
+            red = light == RED
+            okay = ~((waypoint == RIGHT) & red & (left == FORWARD))
+            okay &= ~((waypoint == FORWARD) & red)
+            okay &= ~((waypoint == LEFT) & (red | (oncoming == FORWARD) | (oncoming == RIGHT)))
+            okay &= mask
+            actions = np.where(okay, waypoint, NONE)
+            n = okay.sum()
+            self.waypoint[okay, dummy] = self.np_random.randint(FORWARD, RIGHT + 1, size=n)
+            self.act(actions, agent=dummy, mask=okay)